@@ -0,0 +1,81 @@
+"""
+Benchmark saving a downloaded wallpaper with prompt metadata.
+
+Compares the old path (download into memory, decode with Pillow, re-encode with
+text chunks) against pngtext.save_png_with_text (stream to disk and splice the
+text chunks in). Each run happens in a fresh process so peak RSS is comparable.
+
+How to run:
+   python benchmarks/png_metadata.py
+   python benchmarks/png_metadata.py --runs 5 --width 1792 --height 1024
+"""
+
+import argparse
+import io
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from stubs import StubServer
+from suite import peak_rss_mb, reset_peak_rss_mb
+
+TEXTS = {
+    "Image Prompt": "A serene mountain landscape at dawn",
+    "Revised Prompt": "A serene mountain landscape at dawn, mist rolling through the valleys below snow-capped peaks."
+}
+
+def run_path(path, url, output, results):
+    import requests
+    import pngtext
+    import transport
+    from PIL import Image, PngImagePlugin
+
+    baseline = reset_peak_rss_mb()
+    start = time.perf_counter()
+    if path == "pil":
+        generatedImage = requests.get(url).content
+        newImage = Image.open(io.BytesIO(generatedImage))
+        pngMetaData = PngImagePlugin.PngInfo()
+        for keyword, text in TEXTS.items():
+            pngMetaData.add_text(keyword, text)
+        newImage.save(output, pnginfo=pngMetaData)
+    else:
+        with requests.get(url, stream=True) as response:
+            pngtext.save_png_with_text(response.iter_content(chunk_size=transport.DOWNLOAD_CHUNK_SIZE), output, TEXTS)
+    results.put((time.perf_counter() - start, peak_rss_mb() - baseline))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark PNG metadata saving paths")
+    parser.add_argument("--runs", type=int, default=3, help="Runs per path (default: 3)")
+    parser.add_argument("--width", type=int, default=1792, help="Image width (default: 1792)")
+    parser.add_argument("--height", type=int, default=1024, help="Image height (default: 1024)")
+    args = parser.parse_args()
+
+    stub = StubServer(image_size=(args.width, args.height))
+    url = f"{stub.base_url}/files/image.png"
+    print(f"Serving a {args.width}x{args.height} PNG of {len(stub.image) / (1024 * 1024):.1f} MB")
+
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as directory:
+        for path in ("pil", "stream"):
+            timings, peaks = [], []
+            for run in range(args.runs):
+                results = context.Queue()
+                output = os.path.join(directory, f"{path}-{run}.png")
+                process = context.Process(target=run_path, args=(path, url, output, results))
+                process.start()
+                elapsed, peak = results.get()
+                process.join()
+                timings.append(elapsed)
+                peaks.append(peak)
+            size = os.path.getsize(output) / (1024 * 1024)
+            print(f"{path:>6}: best {min(timings) * 1000:8.1f} ms, peak RSS +{max(peaks):6.1f} MB, output {size:.1f} MB")
+
+    stub.close()
+
+if __name__ == "__main__":
+    main()
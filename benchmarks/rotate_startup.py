@@ -0,0 +1,125 @@
+"""
+Guard the cold-start cost of the `rotate` command.
+
+Runs `generate-wallpaper.py rotate` in a fresh process under `python -X importtime`,
+against a temporary library of synthetic PNGs (with its own config, telemetry
+files and daemon socket directory, and without touching the desktop). Reports
+the import time, the time spent in the command itself (library sync, picking the
+next image, telemetry flush), the slowest imports, and fails when a heavy
+dependency sneaks onto the rotate path or either time goes over budget.
+
+The first run indexes the library, the best of the later runs is the steady state.
+
+How to run:
+   python benchmarks/rotate_startup.py
+   python benchmarks/rotate_startup.py --runs 10 --budget-ms 80 --library-size 10000
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SCRIPT = os.path.join(ROOT, "generate-wallpaper.py")
+# Modules `rotate` must never import
+FORBIDDEN = ["openai", "requests", "PIL", "numpy", "weather_data", "transport", "pngtext"]
+
+# Runs the rotate command as main() would, with everything that lives next to the
+# script (images, library, config.ini) moved to the work directory given as argv[1]
+LOADER = f"""
+import importlib.util, os, sys, time
+sys.path.insert(0, {ROOT!r})
+workdir = sys.argv[1]
+spec = importlib.util.spec_from_file_location("generate_wallpaper", {SCRIPT!r})
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+import telemetry
+start = time.perf_counter()
+module.__file__ = os.path.join(workdir, "generate-wallpaper.py")
+module.change_wallpaper = lambda wallpaper: None
+module.fetch_current_wallpaper = lambda: ""
+recorder = telemetry.recorder()
+recorder.log_path = os.path.join(workdir, telemetry.LOG_FILE)
+recorder.textfile_path = os.path.join(workdir, telemetry.TEXTFILE)
+sys.argv = ["generate-wallpaper.py", "rotate"]
+module.main()
+recorder.flush()
+print(f"rotate {{time.perf_counter() - start}}")
+"""
+
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+ROTATE_LINE = re.compile(r"^rotate (\S+)$", re.MULTILINE)
+
+def make_library(workdir, size):
+    from stubs import make_png
+
+    images = os.path.join(workdir, "images")
+    os.makedirs(images)
+    png = make_png(16, 16)
+    for i in range(size):
+        with open(os.path.join(images, f"wallpaper-{i:06d}.png"), "wb") as f:
+            f.write(png)
+
+def measure(workdir):
+    """Run one cold start, returning wall time, rotate command time and {module: (self_us, cumulative_us, depth)}."""
+    # The daemon socket lives in the temp directory, so a running daemon isn't asked to rotate
+    env = {**os.environ, "TMPDIR": workdir}
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", LOADER, workdir], capture_output=True, text=True, check=True, env=env
+    )
+    elapsed = time.perf_counter() - start
+    modules = {}
+    for match in IMPORT_LINE.finditer(result.stderr):
+        self_us, cumulative_us, indent, name = match.groups()
+        modules[name] = (int(self_us), int(cumulative_us), len(indent) // 2)
+    return elapsed, float(ROTATE_LINE.search(result.stdout).group(1)), modules
+
+def measure_startup():
+    """Modules the bare interpreter imports before running any code."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "pass"], capture_output=True, text=True, check=True)
+    return [match.group(4) for match in IMPORT_LINE.finditer(result.stderr)]
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure rotate cold-start import time")
+    parser.add_argument("--runs", type=int, default=5, help="Number of cold starts (default: 5)")
+    parser.add_argument("--budget-ms", type=float, default=100, help="Fail when the best import time exceeds this (default: 100)")
+    parser.add_argument("--rotate-budget-ms", type=float, default=50, help="Fail when the best warm rotate command exceeds this (default: 50)")
+    parser.add_argument("--library-size", type=int, default=1000, help="Synthetic wallpapers in the library (default: 1000)")
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest imports to list (default: 10)")
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as workdir:
+        make_library(workdir, args.library_size)
+        first = measure(workdir)
+        runs = [measure(workdir) for _ in range(max(1, args.runs))]
+    elapsed, rotate_seconds, modules = min(runs, key=lambda run: run[0])
+    rotate_ms = min(run[1] for run in runs) * 1000
+    # Top-level imports made by the script itself, excluding interpreter startup (site and friends)
+    startup = set(measure_startup())
+    script_imports = {name: data for name, data in modules.items() if data[2] == 0 and name not in startup}
+    import_ms = sum(data[1] for data in script_imports.values()) / 1000
+
+    print(f"Process wall time: best {elapsed * 1000:.1f} ms over {args.runs} runs")
+    print(f"Script imports:    {import_ms:.1f} ms")
+    print(f"Rotate command:    {rotate_ms:.1f} ms warm, {first[1] * 1000:.1f} ms indexing {args.library_size} wallpapers")
+    print("Slowest imports (cumulative):")
+    for name, data in sorted(script_imports.items(), key=lambda item: item[1][1], reverse=True)[:args.top]:
+        print(f"  {data[1] / 1000:8.1f} ms  {name}")
+
+    failures = [name for name in FORBIDDEN if name in modules or name in first[2]]
+    if failures:
+        print(f"FAIL: rotate imports {', '.join(failures)}")
+    if import_ms > args.budget_ms:
+        print(f"FAIL: import time {import_ms:.1f} ms is over the {args.budget_ms:.0f} ms budget")
+    if rotate_ms > args.rotate_budget_ms:
+        print(f"FAIL: rotate took {rotate_ms:.1f} ms, over the {args.rotate_budget_ms:.0f} ms budget")
+    sys.exit(1 if failures or import_ms > args.budget_ms or rotate_ms > args.rotate_budget_ms else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+Local stand-ins for the OpenAI, Open-Meteo and GitHub APIs.
+
+StubServer answers the endpoints this tool calls with realistic payloads after a
+configurable delay, so the real code paths (the openai client, the shared
+transport, the weather cache) can be benchmarked without keys or network:
+
+   POST /v1/chat/completions                  prompts (JSON) or a weather prompt, streamed on request
+   POST /v1/images/generations                an image URL on this server
+   GET  /v1/search                            Open-Meteo geocoding
+   GET  /v1/forecast                          Open-Meteo forecast
+   GET  /repos/<owner>/<repo>/releases/latest GitHub release with city assets
+   GET  /files/<name>                         the PNG payload
+
+Point the openai client at `server.openai_base_url` and call `redirect()` on the
+shared transport's session to send api.github.com and open-meteo.com requests here.
+"""
+
+import hashlib
+import http.server
+import io
+import json
+import os
+import re
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from requests.adapters import HTTPAdapter
+
+REDIRECTED_HOSTS = ["api.github.com", "geocoding-api.open-meteo.com", "api.open-meteo.com"]
+
+def make_png(width, height, seed=0):
+    """Random noise compresses about as badly as a detailed HD wallpaper."""
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    noise = hashlib.shake_256(str(seed).encode()).digest(width * height * 3)
+    Image.frombytes("RGB", (width, height), noise).save(buffer, "PNG")
+    return buffer.getvalue()
+
+class RedirectAdapter(HTTPAdapter):
+    """Rewrites requests for the real API hosts to the stub server."""
+
+    def __init__(self, base_url, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = base_url
+
+    def send(self, request, **kwargs):
+        parts = urlsplit(request.url)
+        request.url = f"{self.base_url}{parts.path}{'?' + parts.query if parts.query else ''}"
+        return super().send(request, **kwargs)
+
+def redirect(session, base_url):
+    adapter = RedirectAdapter(base_url)
+    for host in REDIRECTED_HOSTS:
+        session.mount(f"https://{host}/", adapter)
+
+class StubServer:
+    """Serve the stub APIs on a free local port.
+
+    `latency` is the delay in seconds before each API reply, `image_latency` the
+    delay before an image or asset download starts. `forecast_days` sizes the
+    forecast payload and `assets` is the number of city assets in the release.
+    """
+
+    def __init__(self, latency=0.0, image_latency=0.0, image_size=(1792, 1024), forecast_days=1, assets=50):
+        self.latency = latency
+        self.image_latency = image_latency
+        self.forecast_days = forecast_days
+        self.image = make_png(*image_size)
+        self.image_digest = "sha256:" + hashlib.sha256(self.image).hexdigest()
+        self.cities = [f"City.{i}" for i in range(assets)]
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    @property
+    def openai_base_url(self):
+        return f"{self.base_url}/v1"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, route):
+        with self.lock:
+            self.requests[route] = self.requests.get(route, 0) + 1
+
+    def release(self):
+        return {
+            "tag_name": "generate/2026.10.18",
+            "assets": [
+                {
+                    "name": f"{city}.png",
+                    "size": len(self.image),
+                    "digest": self.image_digest,
+                    "browser_download_url": f"{self.base_url}/files/{city}.png"
+                }
+                for city in self.cities
+            ]
+        }
+
+    def chat_completion(self, body):
+        messages = body.get("messages", [])
+        salt = os.urandom(4).hex()
+        if body.get("response_format"):
+            match = re.search(r"Generate (\d+) prompts", " ".join(m["content"] for m in messages))
+            count = int(match.group(1)) if match else 1
+            content = json.dumps({"prompts": [
+                f"A luminous dreamscape of floating islands and glass rivers, variation {salt}-{i}" for i in range(count)
+            ]})
+        else:
+            content = f"A misty city street after light rain, reflections shimmering in soft evening light, painted in muted watercolour tones, study {salt}."
+        return {
+            "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()), "model": body.get("model"),
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": 100, "completion_tokens": 50, "total_tokens": 150}
+        }
+
+    def chat_completion_chunks(self, body, piece_size=24):
+        """The same completion as server-sent event chunks of `piece_size` characters, then the usage."""
+        completion = self.chat_completion(body)
+        content = completion["choices"][0]["message"]["content"]
+        base = {"id": completion["id"], "object": "chat.completion.chunk", "created": completion["created"], "model": completion["model"]}
+        for start in range(0, len(content), piece_size):
+            delta = {"content": content[start:start + piece_size]}
+            if start == 0:
+                delta["role"] = "assistant"
+            yield {**base, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+        yield {**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        yield {**base, "choices": [], "usage": completion["usage"]}
+
+    def image_generation(self, body):
+        return {
+            "created": int(time.time()),
+            "data": [{"url": f"{self.base_url}/files/image.png", "revised_prompt": f"{body.get('prompt', '')} Rendered in high detail."}]
+        }
+
+    def geocode(self, query):
+        return {"results": [{"name": query.get("name", ["?"])[0], "latitude": 51.5074, "longitude": -0.1278, "country": "United Kingdom"}]}
+
+    def forecast(self, query):
+        days = self.forecast_days
+        hours = 24 * days
+        if query.get("timeformat") == ["unixtime"]:
+            midnight = int(time.time()) // 86400 * 86400
+            times = [midnight + 3600 * h for h in range(hours)]
+        else:
+            times = [f"2026-10-{18 + h // 24:02d}T{h % 24:02d}:00" for h in range(hours)]
+        return {
+            "latitude": 51.5, "longitude": -0.13, "timezone": "Europe/London",
+            "current_weather": {"temperature": 14.2, "windspeed": 11.0, "winddirection": 240, "weathercode": 61, "is_day": 1, "time": "2026-10-18T12:00"},
+            "hourly": {
+                "time": times,
+                "temperature_2m": [10 + (h % 24) / 3 for h in range(hours)],
+                "weathercode": [(0, 3, 61, 63)[(h // 6) % 4] for h in range(hours)],
+                "is_day": [int(7 <= h % 24 < 19) for h in range(hours)]
+            },
+            "daily": {
+                "time": [f"2026-10-{18 + d:02d}" for d in range(days)],
+                "temperature_2m_max": [17.0] * days,
+                "temperature_2m_min": [9.0] * days,
+                "weathercode": [61] * days
+            }
+        }
+
+    def _handler(self):
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def send_json(self, payload, headers=()):
+                data = json.dumps(payload).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def send_events(self, events):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for event in [*(f"data: {json.dumps(event)}\n\n" for event in events), "data: [DONE]\n\n"]:
+                    data = event.encode()
+                    self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                    self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                path = urlsplit(self.path).path
+                time.sleep(stub.latency)
+                if path.endswith("/chat/completions"):
+                    stub.count("chat")
+                    if body.get("stream"):
+                        self.send_events(stub.chat_completion_chunks(body))
+                    else:
+                        self.send_json(stub.chat_completion(body))
+                elif path.endswith("/images/generations"):
+                    stub.count("images")
+                    self.send_json(stub.image_generation(body))
+                else:
+                    self.send_error(404)
+
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                query = parse_qs(parts.query)
+                if parts.path.startswith("/files/"):
+                    stub.count("download")
+                    time.sleep(stub.image_latency)
+                    self.send_response(200)
+                    self.send_header("Content-Type", "image/png")
+                    self.send_header("Content-Length", str(len(stub.image)))
+                    self.end_headers()
+                    self.wfile.write(stub.image)
+                    return
+                time.sleep(stub.latency)
+                if parts.path == "/v1/search":
+                    stub.count("geocode")
+                    self.send_json(stub.geocode(query))
+                elif parts.path == "/v1/forecast":
+                    stub.count("forecast")
+                    self.send_json(stub.forecast(query))
+                elif parts.path.endswith("/releases/latest"):
+                    stub.count("release")
+                    etag = '"stub-release"'
+                    if self.headers.get("If-None-Match") == etag:
+                        self.send_response(304)
+                        self.send_header("ETag", etag)
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                    else:
+                        self.send_json(stub.release(), [("ETag", etag)])
+                else:
+                    self.send_error(404)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,283 @@
+"""
+Offline benchmark suite for the main code paths.
+
+Runs each scenario in a fresh process against benchmarks/stubs.py (stand-ins for
+OpenAI, Open-Meteo and GitHub), with its own temporary library, and reports wall
+time per step and peak RSS. Nothing touches the real library, the weather cache
+or the desktop. With --profile, cProfile records the benchmarked calls in the
+scenario's main thread; work done in worker threads shows up there as waits.
+
+   rotate    index a synthetic library of N PNGs, then rotate through it
+   generate  generate_image: request, download, splice metadata, sidecar, index
+   batch     prompt generation plus image generation for --count images
+   fetch     fetch_latest_city_wallpapers for --cities cities, then again (304)
+   weather   geocode and forecast for --cities cities, cold and cached
+
+How to run:
+   python benchmarks/suite.py
+   python benchmarks/suite.py rotate --library-sizes 1000,100000
+   python benchmarks/suite.py --latency-ms 200 --profile profiles/
+   python benchmarks/suite.py --output before.json
+   python benchmarks/suite.py --baseline before.json --tolerance 0.25
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCHMARKS, "..")
+SCRIPT = os.path.join(ROOT, "generate-wallpaper.py")
+SCENARIOS = ["rotate", "generate", "batch", "fetch", "weather"]
+
+def peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def reset_peak_rss_mb():
+    """Restart peak RSS tracking from the current RSS, and return that as the baseline.
+
+    Linux carries ru_maxrss over fork and exec, so a spawned process starts with
+    the peak of its parent; clearing VmHWM drops it.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+    return peak_rss_mb()
+
+def load_script(workdir):
+    """Import generate-wallpaper.py with its library, job queue, desktop and reuse hooks pointed at `workdir`.
+
+    Telemetry is switched off so benchmark runs don't end up in the real log.
+    """
+    import importlib.util
+    import job_queue
+    import library
+    import telemetry
+
+    spec = importlib.util.spec_from_file_location("generate_wallpaper", SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.get_library = lambda: library.open_library(os.path.join(workdir, library.LIBRARY_FILE))
+    module.get_job_queue = lambda: job_queue.open_queue(os.path.join(workdir, job_queue.QUEUE_FILE))
+    module.change_wallpaper = lambda wallpaper: None
+    module.fetch_current_wallpaper = lambda: None
+    module.get_reuse_policy()["ratio"] = 0
+    telemetry.recorder().enabled = False
+    return module
+
+def openai_client(base_url):
+    from openai import OpenAI
+
+    return OpenAI(base_url=base_url, api_key="stub", max_retries=0)
+
+class Timer:
+    """Collects named timings, profiling every timed block when a profiler is given."""
+
+    def __init__(self, profiler=None):
+        self.profiler = profiler
+        self.timings = {}
+
+    @contextlib.contextmanager
+    def time(self, name, repeat=1):
+        if self.profiler:
+            self.profiler.enable()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = (time.perf_counter() - start) / repeat
+            if self.profiler:
+                self.profiler.disable()
+
+def bench_rotate(script, timer, workdir, options, stub_url):
+    from stubs import make_png
+
+    png = make_png(16, 16)
+    for size in options["library_sizes"]:
+        directory = os.path.join(workdir, f"library-{size}")
+        os.makedirs(directory)
+        for i in range(size):
+            with open(os.path.join(directory, f"wallpaper-{i:06d}.png"), "wb") as f:
+                f.write(png)
+        with timer.time(f"rotate[{size}] first (indexes)"):
+            script.rotate_wallpaper(directory)
+        rotations = options["rotations"]
+        with timer.time(f"rotate[{size}] warm", rotations):
+            for _ in range(rotations):
+                script.rotate_wallpaper(directory)
+
+def bench_generate(script, timer, workdir, options, stub_url):
+    client = openai_client(f"{stub_url}/v1")
+    count = options["count"]
+    with timer.time("generate_image", count):
+        for i in range(count):
+            script.generate_image(client, f"A quiet harbour at dawn, study {i}", workdir)
+
+def bench_batch(script, timer, workdir, options, stub_url):
+    client = openai_client(f"{stub_url}/v1")
+    generated_images = []
+    with timer.time(f"batch[{options['count']}] prompts only"):
+        script.generate_prompts(client, options["count"], "Calm abstract landscapes", options["concurrency"])
+    with timer.time(f"batch[{options['count']}] prompts and images"):
+        script.handle_prompt_generation(
+            client, options["count"], "Calm abstract landscapes", workdir, generated_images, options["concurrency"]
+        )
+    if len(generated_images) != options["count"]:
+        raise RuntimeError(f"Generated {len(generated_images)} of {options['count']} images")
+
+def bench_fetch(script, timer, workdir, options, stub_url):
+    cities = [f"City {i}" for i in range(options["cities"])]
+    with timer.time(f"fetch[{len(cities)}] download"):
+        fetched = script.fetch_latest_city_wallpapers(cities, workdir, options["concurrency"])
+    if not all(fetched.values()):
+        raise RuntimeError(f"Failed to fetch {[city for city, path in fetched.items() if not path]}")
+    with timer.time(f"fetch[{len(cities)}] up to date"):
+        script.fetch_latest_city_wallpapers(cities, workdir, options["concurrency"])
+
+def bench_weather(script, timer, workdir, options, stub_url):
+    import weather_cache
+    import weather_data
+
+    cache = weather_cache.WeatherCache(os.path.join(workdir, weather_cache.CACHE_FILE))
+    cities = [f"City {i}" for i in range(options["cities"])]
+    for label in ("cold", "cached"):
+        with timer.time(f"weather[{len(cities)}] {label}", len(cities)):
+            for city in cities:
+                if weather_data.fetch_weather(city, cache=cache) is None:
+                    raise RuntimeError(f"No weather for {city}")
+
+def run_scenario(name, options, stub_url, profile_path, results):
+    sys.path[:0] = [ROOT, BENCHMARKS]
+    import cProfile
+    import transport
+    from stubs import redirect
+
+    redirect(transport.default_transport().session, stub_url)
+    profiler = cProfile.Profile() if profile_path else None
+    timer = Timer(profiler)
+    baseline = reset_peak_rss_mb()
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            script = load_script(workdir)
+            output = sys.stdout if options["verbose"] else io.StringIO()
+            with contextlib.redirect_stdout(output):
+                globals()[f"bench_{name}"](script, timer, workdir, options, stub_url)
+        if profiler:
+            profiler.dump_stats(profile_path)
+        results.put((timer.timings, peak_rss_mb(), baseline, None))
+    except Exception as e:
+        results.put((timer.timings, peak_rss_mb(), baseline, f"{type(e).__name__}: {e}"))
+
+def print_profile(path, limit):
+    import pstats
+
+    print(f"  profile: {path}")
+    stream = io.StringIO()
+    pstats.Stats(path, stream=stream).sort_stats("cumulative").print_stats(limit)
+    for line in stream.getvalue().splitlines():
+        if line.strip() and not line.startswith(("   Ordered by", "   List reduced")):
+            print(f"    {line}")
+
+def compare(results, baseline_path, tolerance):
+    """Print every timing that got slower than the baseline by more than `tolerance`. Returns the count."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    regressions = 0
+    for scenario, result in results.items():
+        for step, seconds in result["timings"].items():
+            before = baseline.get(scenario, {}).get("timings", {}).get(step)
+            if before and seconds > before * (1 + tolerance):
+                print(f"REGRESSION {scenario}: {step} {before * 1000:.1f} ms -> {seconds * 1000:.1f} ms")
+                regressions += 1
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the wallpaper generator against local stub APIs")
+    parser.add_argument("scenarios", nargs="*", help=f"Scenarios to run (default: all of {', '.join(SCENARIOS)})")
+    parser.add_argument("--latency-ms", type=float, default=20, help="Delay before every API reply (default: 20)")
+    parser.add_argument("--image-latency-ms", type=float, default=50, help="Delay before every image download (default: 50)")
+    parser.add_argument("--image-size", type=str, default="1792x1024", help="Size of the served PNG (default: 1792x1024)")
+    parser.add_argument("--forecast-days", type=int, default=1, help="Days in the forecast payload (default: 1)")
+    parser.add_argument("--library-sizes", type=str, default="1000,10000,100000", help="Synthetic library sizes for rotate (default: 1000,10000,100000)")
+    parser.add_argument("--rotations", type=int, default=50, help="Warm rotations timed per library (default: 50)")
+    parser.add_argument("--count", type=int, default=10, help="Images for generate and batch (default: 10)")
+    parser.add_argument("--cities", type=int, default=10, help="Cities for fetch and weather (default: 10)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrency for batch and fetch (default: 4)")
+    parser.add_argument("--profile", type=str, metavar="DIR", help="Write a cProfile .prof file per scenario to DIR and print the top functions")
+    parser.add_argument("--profile-limit", type=int, default=15, help="Functions printed per profile (default: 15)")
+    parser.add_argument("--output", type=str, help="Write the results as JSON, e.g. to use as a later --baseline")
+    parser.add_argument("--baseline", type=str, help="Fail when a step is slower than in this earlier --output file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown against --baseline (default: 0.25)")
+    parser.add_argument("--verbose", action="store_true", help="Show the output of the code under test")
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+
+    sys.path.insert(0, BENCHMARKS)
+    from stubs import StubServer
+
+    width, height = (int(value) for value in args.image_size.lower().split("x"))
+    stub = StubServer(args.latency_ms / 1000, args.image_latency_ms / 1000, (width, height), args.forecast_days, max(args.cities, 1))
+    print(f"Stub APIs on {stub.base_url}: {args.latency_ms:.0f} ms API latency, "
+          f"{args.image_latency_ms:.0f} ms to first image byte, {len(stub.image) / (1024 * 1024):.1f} MB PNG")
+    options = {
+        "library_sizes": [int(size) for size in args.library_sizes.split(",") if size.strip()],
+        "rotations": args.rotations,
+        "count": args.count,
+        "cities": args.cities,
+        "concurrency": args.concurrency,
+        "verbose": args.verbose
+    }
+    if args.profile:
+        os.makedirs(args.profile, exist_ok=True)
+
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    failed = False
+    for name in args.scenarios or SCENARIOS:
+        profile_path = os.path.join(args.profile, f"{name}.prof") if args.profile else None
+        queue = context.Queue()
+        process = context.Process(target=run_scenario, args=(name, options, stub.base_url, profile_path, queue))
+        process.start()
+        timings, peak, baseline, error = queue.get()
+        process.join()
+        results[name] = {"timings": timings, "peak_rss_mb": peak}
+
+        print(f"{name}: peak RSS {peak:.1f} MB (+{peak - baseline:.1f} MB while running)")
+        for step, seconds in timings.items():
+            print(f"  {step:<36} {seconds * 1000:10.2f} ms")
+        if error:
+            print(f"  FAILED: {error}")
+            failed = True
+        elif profile_path:
+            print_profile(profile_path, args.profile_limit)
+    stub.close()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline and compare(results, args.baseline, args.tolerance):
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
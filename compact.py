@@ -0,0 +1,202 @@
+"""
+Storage compaction of the wallpaper library.
+
+DALL-E and the release assets are stored as the PNGs they were delivered as.
+Compaction re-encodes them in a process pool, either as PNG at maximum zlib
+compression or as lossless WebP, and keeps the result only when it is smaller.
+WebP output is decoded again and compared pixel for pixel before the original
+is replaced. 16 bit PNGs are left alone, as are PNGs with gamma or chromaticity
+chunks when converting to WebP. Prompt metadata moves along: PNG text and colour
+space chunks are written again, WebP files carry the text in an XMP packet, and
+the sidecar .json keeps the same base name with its "filename" pointing at the
+new file. Modification times are preserved, so rotation order doesn't change,
+and rendered display variants are kept for the new file.
+
+Compacted images are recorded in the library index, so later runs only encode
+new images.
+
+How to run:
+   python generate-wallpaper.py compact                  # recompress PNGs
+   python generate-wallpaper.py compact --format webp    # convert to lossless WebP
+
+Or compact every new batch after `generate` in config.ini:
+   [Compact]
+   format = webp
+   after_generate = true
+"""
+
+import io
+import json
+import os
+import struct
+from xml.sax.saxutils import quoteattr
+
+import pngtext
+
+FORMATS = {"png": ".png", "webp": ".webp"}
+# Modes WebP stores without losing information, after at most a lossless conversion
+WEBP_MODES = {"RGB": "RGB", "RGBA": "RGBA", "L": "RGB", "LA": "RGBA", "P": "RGBA", "1": "RGB"}
+# Colour space chunks, copied as they are since Pillow reads but doesn't write them
+COLOUR_CHUNKS = (b"gAMA", b"cHRM", b"sRGB", b"iCCP")
+XMP_NAMESPACE = "https://github.com/theonlysinjin/wallpaper-generator/ns/1.0/"
+
+def xmp_packet(texts):
+    """Wrap PNG text metadata in an XMP packet, one attribute per keyword."""
+    attributes = "".join(
+        f"\n    wallpaper:{''.join(c for c in keyword if c.isalnum())}={quoteattr(text or '')}" for keyword, text in texts.items()
+    )
+    return (
+        '<?xpacket begin="\ufeff" id="W5M0MpCehiHzreSzNTczkc9d"?>\n'
+        '<x:xmpmeta xmlns:x="adobe:ns:meta/">\n'
+        ' <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">\n'
+        f'  <rdf:Description rdf:about="" xmlns:wallpaper="{XMP_NAMESPACE}"{attributes}/>\n'
+        ' </rdf:RDF>\n'
+        '</x:xmpmeta>\n'
+        '<?xpacket end="w"?>'
+    ).encode("utf-8")
+
+def png_header(path):
+    """Read a PNG's IHDR bit depth and colour type and its raw colour space chunks, without decoding it.
+
+    Returns (bit_depth, colour_type, [chunk bytes]), or None when `path` isn't a PNG.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(pngtext.PNG_SIGNATURE)) != pngtext.PNG_SIGNATURE:
+            return None
+        bit_depth, colour_type, colour_chunks = None, None, []
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                break
+            length, chunk_type = struct.unpack(">I4s", header)
+            # Colour space chunks have to come before the image data
+            if chunk_type in (b"IDAT", b"IEND"):
+                break
+            data = f.read(length + 4)
+            if chunk_type == b"IHDR":
+                bit_depth, colour_type = data[8], data[9]
+            elif chunk_type in COLOUR_CHUNKS:
+                colour_chunks.append(header + data)
+    return bit_depth, colour_type, colour_chunks
+
+def encode_png(image, texts, colour_chunks):
+    buffer = io.BytesIO()
+    # The original colour chunks, iCCP included, are spliced in below; Pillow would write a second iCCP
+    image.save(buffer, "PNG", optimize=True, icc_profile=None)
+    data = buffer.getvalue()
+    # Pillow would write the text chunks at the end, splice them after IHDR like freshly generated images
+    chunks = b"".join(colour_chunks) + b"".join(pngtext.text_chunk(keyword, text) for keyword, text in texts.items())
+    return data[:pngtext.HEADER_LENGTH] + chunks + data[pngtext.HEADER_LENGTH:]
+
+def encode_webp(image, texts):
+    from PIL import Image
+
+    mode = WEBP_MODES.get(image.mode)
+    if mode is None:
+        return None
+    if "transparency" in image.info:
+        # A tRNS chunk on an RGB or greyscale PNG
+        mode = "RGBA"
+    pixels = image.convert(mode)
+    options = {"icc_profile": image.info.get("icc_profile")}
+    if texts:
+        options["xmp"] = xmp_packet(texts)
+    buffer = io.BytesIO()
+    pixels.save(buffer, "WEBP", lossless=True, quality=100, method=4, exact=True, **options)
+    data = buffer.getvalue()
+    with Image.open(io.BytesIO(data)) as decoded:
+        if decoded.convert(mode).tobytes() != pixels.tobytes():
+            return None
+    return data
+
+def compact_image(path, image_format):
+    """Re-encode one image. Runs in worker processes.
+
+    Writes the smaller encoding next to `path` (replacing it when the extension
+    stays the same) and returns (path, new_path, bytes_before, bytes_after);
+    new_path is `path` itself when nothing smaller was found. Returns None for
+    unreadable images and for images the format can't hold losslessly.
+    """
+    from PIL import Image
+
+    stat = os.stat(path)
+    try:
+        header = png_header(path)
+        if header is None and image_format == "png":
+            return None
+        if header:
+            bit_depth, colour_type, colour_chunks = header
+            # WebP only holds 8 bit, and Pillow decodes every 16 bit PNG but plain greyscale to 8 bit
+            if bit_depth == 16 and (image_format == "webp" or colour_type != 0):
+                return None
+            if image_format == "webp" and any(chunk[4:8] != b"iCCP" for chunk in colour_chunks):
+                return None
+        with Image.open(path) as image:
+            image.load()
+            texts = dict(getattr(image, "text", {}))
+            if image_format == "png":
+                data = encode_png(image, texts, colour_chunks)
+            else:
+                data = encode_webp(image, texts)
+    except (OSError, ValueError, SyntaxError):
+        return None
+    if data is None or len(data) >= stat.st_size:
+        return path, path, stat.st_size, stat.st_size
+
+    new_path = os.path.splitext(path)[0] + FORMATS[image_format]
+    partial_path = f"{new_path}.part"
+    with open(partial_path, "wb") as f:
+        f.write(data)
+    os.utime(partial_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    os.replace(partial_path, new_path)
+    return path, new_path, stat.st_size, len(data)
+
+def compact_images(paths, image_format, workers=None):
+    """Yield the compact_image result for every path, in order."""
+    if not paths:
+        return
+    if len(paths) == 1:
+        yield compact_image(paths[0], image_format)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(compact_image, paths, [image_format] * len(paths), chunksize=4)
+
+def update_sidecar(old_path, new_path):
+    json_path = f"{os.path.splitext(old_path)[0]}.json"
+    try:
+        with open(json_path) as json_file:
+            json_data = json.load(json_file)
+    except (OSError, ValueError):
+        return
+    if "filename" not in json_data:
+        return
+    json_data["filename"] = new_path
+    partial_path = f"{json_path}.part"
+    with open(partial_path, "w") as json_file:
+        json.dump(json_data, json_file, indent=2)
+    os.replace(partial_path, json_path)
+
+def compact_library(library, paths, image_format, workers=None, derivative_cache=None):
+    """Compact `paths` and move their index rows, sidecars and display variants to the new files.
+
+    Returns {"images", "bytes_before", "bytes_after", "renamed": {old: new}}.
+    """
+    stats = {"images": 0, "bytes_before": 0, "bytes_after": 0, "renamed": {}}
+    for result in compact_images(paths, image_format, workers):
+        if result is None:
+            continue
+        old_path, new_path, bytes_before, bytes_after = result
+        # Index and sidecar point at the new file before the old one disappears
+        library.set_compacted(old_path, new_path, image_format)
+        if derivative_cache and bytes_after != bytes_before:
+            derivative_cache.move_source(old_path, new_path)
+        if new_path != old_path:
+            update_sidecar(old_path, new_path)
+            os.remove(old_path)
+            stats["renamed"][old_path] = new_path
+        stats["images"] += 1
+        stats["bytes_before"] += bytes_before
+        stats["bytes_after"] += bytes_after
+    return stats
@@ -0,0 +1,154 @@
+"""
+Long-running scheduler for the wallpaper jobs.
+
+Runs named jobs on their own timers inside one resident process, so HTTP
+sessions, the OpenAI client and the library index stay warm between runs. A
+local Unix socket accepts one-line commands to trigger a job immediately:
+
+   rotate | fetch | generate   start that job now (also drain, and pregenerate with --lookahead)
+   status                      list jobs with their last run and result
+   stop                        shut the daemon down
+"""
+
+import os
+import socket
+import socketserver
+import tempfile
+import threading
+import time
+
+def default_socket_path():
+    # Kept short: macOS limits Unix socket paths to 104 bytes
+    return os.path.join(tempfile.gettempdir(), f"wallpaper-generator-{os.getuid()}.sock")
+
+def send_command(command, socket_path=None, timeout=2):
+    """Send a command to a running daemon. Returns its reply, or None when no daemon is listening."""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(timeout)
+            client.connect(socket_path or default_socket_path())
+            client.sendall(f"{command}\n".encode())
+            return client.makefile().readline().strip()
+    except OSError:
+        return None
+
+class Job:
+    def __init__(self, name, func, interval=None):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.next_run = time.monotonic() if interval else None
+        self.last_run = None
+        self.last_result = None
+        self.once = False
+        self.running = threading.Lock()
+
+class Daemon:
+    def __init__(self, socket_path=None):
+        self.socket_path = socket_path or default_socket_path()
+        self.jobs = {}
+        self.wakeup = threading.Event()
+        self.stopping = False
+
+    def add_job(self, name, func, interval=None):
+        """Register a job. Without an interval it only runs when triggered over the socket."""
+        self.jobs[name] = Job(name, func, interval)
+
+    def run_at(self, name, func, when):
+        """Run `func` once at the Unix time `when`, replacing any pending job with the same name."""
+        job = Job(name, func)
+        job.next_run = time.monotonic() + max(0, when - time.time())
+        job.once = True
+        self.jobs[name] = job
+        self.wakeup.set()
+
+    def cancel(self, prefix):
+        """Drop pending one-off jobs whose name starts with `prefix`."""
+        for name in [name for name, job in list(self.jobs.items()) if job.once and name.startswith(prefix)]:
+            self.jobs.pop(name, None)
+
+    def trigger(self, name):
+        """Run a job in the background, unless it is already running."""
+        return self._start(self.jobs[name])
+
+    def _start(self, job):
+        if not job.running.acquire(blocking=False):
+            return False
+        threading.Thread(target=self._run, args=(job,), daemon=True).start()
+        return True
+
+    def _run(self, job):
+        try:
+            job.last_result = job.func()
+        except Exception as e:
+            job.last_result = f"error: {str(e)}"
+            print(f"Job {job.name} failed: {str(e)}")
+        finally:
+            job.last_run = time.time()
+            job.running.release()
+
+    def handle_command(self, command):
+        if command in self.jobs:
+            return f"ok {command} {'started' if self.trigger(command) else 'already running'}"
+        if command == "status":
+            return "ok " + "; ".join(
+                f"{job.name} every {job.interval or '-'}s, last run "
+                f"{time.strftime('%H:%M:%S', time.localtime(job.last_run)) if job.last_run else 'never'}: {job.last_result}"
+                for job in list(self.jobs.values())
+            )
+        if command == "stop":
+            self.stop()
+            return "ok stopping"
+        return f"error unknown command {command!r}"
+
+    def serve_forever(self):
+        """Run the jobs until stopped. Returns False straight away when another daemon owns the socket."""
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                command = self.rfile.readline().decode().strip()
+                self.wfile.write(f"{daemon.handle_command(command)}\n".encode())
+
+        if os.path.exists(self.socket_path):
+            if send_command("status", self.socket_path) is not None:
+                print(f"Another daemon is already listening on {self.socket_path}")
+                return False
+            # A socket left behind by a crashed daemon would make bind fail
+            os.remove(self.socket_path)
+        try:
+            server = socketserver.ThreadingUnixStreamServer(self.socket_path, Handler)
+        except OSError as e:
+            # Another daemon bound the socket in the meantime
+            print(f"Could not listen on {self.socket_path}: {str(e)}")
+            return False
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Daemon listening on {self.socket_path}")
+
+        try:
+            while not self.stopping:
+                now = time.monotonic()
+                for job in list(self.jobs.values()):
+                    if job.next_run is not None and job.next_run <= now:
+                        if job.once:
+                            if self.jobs.get(job.name) is job:
+                                del self.jobs[job.name]
+                            self._start(job)
+                            continue
+                        job.next_run = now + job.interval
+                        self.trigger(job.name)
+                due = [job.next_run for job in list(self.jobs.values()) if job.next_run is not None]
+                self.wakeup.wait(max(0, min(due) - time.monotonic()) if due else None)
+                self.wakeup.clear()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.shutdown()
+            server.server_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+        return True
+
+    def stop(self):
+        self.stopping = True
+        self.wakeup.set()
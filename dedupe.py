@@ -0,0 +1,103 @@
+"""
+Perceptual-hash deduplication of the wallpaper library.
+
+Every image gets a 64 bit difference hash (dHash): the image is shrunk to a 9x8
+greyscale thumbnail and each bit records whether a pixel is brighter than its
+left neighbour. Near-identical wallpapers end up a few bits apart. Thumbnails are
+decoded in a process pool and hashed in one vectorised NumPy pass. The hashes
+are stored in the library index, which answers near-duplicate lookups through
+multi-index hashing instead of comparing against every image.
+
+How to run:
+   python generate-wallpaper.py dedupe              # list near-duplicates
+   python generate-wallpaper.py dedupe --delete     # remove them, keeping the oldest
+"""
+
+import os
+
+HASH_SIZE = 8
+DEFAULT_THRESHOLD = 6
+# Lookups stay sublinear while each 16 bit chunk is searched within 2 bit flips
+MAX_THRESHOLD = 11
+
+def thumbnail(path):
+    """Decode an image into the (HASH_SIZE + 1) x HASH_SIZE greyscale thumbnail the hash is built from."""
+    from PIL import Image
+
+    try:
+        with Image.open(path) as image:
+            return image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.BOX).tobytes()
+    except OSError:
+        return None
+
+def dhashes(thumbnails):
+    """Hash a stack of thumbnails, shaped (N, HASH_SIZE, HASH_SIZE + 1), in one pass."""
+    import numpy as np
+
+    brighter = thumbnails[:, :, 1:] > thumbnails[:, :, :-1]
+    packed = np.packbits(brighter.reshape(len(thumbnails), -1), axis=1)
+    return packed.view(">u8").ravel().tolist()
+
+def hash_images(paths, workers=None):
+    """Return {path: dHash} for every readable image in `paths`."""
+    import numpy as np
+
+    if not paths:
+        return {}
+    if len(paths) == 1:
+        thumbnails = [thumbnail(paths[0])]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            thumbnails = list(executor.map(thumbnail, paths, chunksize=16))
+
+    readable = [(path, data) for path, data in zip(paths, thumbnails) if data is not None]
+    if not readable:
+        return {}
+    pixels = np.frombuffer(b"".join(data for _, data in readable), dtype=np.uint8)
+    pixels = pixels.reshape(len(readable), HASH_SIZE, HASH_SIZE + 1)
+    return dict(zip((path for path, _ in readable), dhashes(pixels)))
+
+def index_hashes(library, directory, workers=None):
+    """Hash the images in `directory` that don't have a perceptual hash yet. Returns how many were hashed."""
+    hashes = hash_images(library.unhashed_images(directory), workers)
+    for path, phash in hashes.items():
+        library.set_phash(path, phash)
+    return len(hashes)
+
+def find_duplicates(library, directory, threshold=DEFAULT_THRESHOLD):
+    """Group near-duplicates as [(original, [duplicates])], keeping the oldest image of each group."""
+    hashes = library.phashes(directory)
+    order = {path: position for position, path in enumerate(hashes)}
+    duplicates = set()
+    groups = []
+    for path in hashes:
+        if path in duplicates:
+            continue
+        matches = [
+            match for match, _ in library.similar_images(hashes[path], threshold, directory)
+            if match not in duplicates and order.get(match, -1) > order[path]
+        ]
+        if matches:
+            groups.append((path, matches))
+            duplicates.update(matches)
+    return groups
+
+def check_new_image(library, path, threshold=DEFAULT_THRESHOLD):
+    """Hash a freshly generated image and return the existing images it nearly duplicates."""
+    if library.phash(path) is not None:
+        # Already hashed, so not new (e.g. an image reused from the library)
+        return []
+    hashes = hash_images([path])
+    if path not in hashes:
+        return []
+    matches = library.similar_images(hashes[path], threshold, os.path.dirname(path))
+    library.set_phash(path, hashes[path])
+    return [match for match, _ in matches if match != path]
+
+def remove_image(library, path):
+    """Delete an image with its sidecar JSON and drop it from the index."""
+    for file_path in (path, f"{os.path.splitext(path)[0]}.json"):
+        if os.path.exists(file_path):
+            os.remove(file_path)
+    library.remove(path)
@@ -0,0 +1,196 @@
+"""
+Per-display wallpaper variants.
+
+DALL-E wallpapers are 1792x1024, so every desktop rescales them on each change.
+When display sizes are configured, each wallpaper is resized and centre-cropped
+once per display and the variant is stored in a content-addressed cache keyed by
+the source image's hash and the target geometry. The cache is bounded by total
+bytes and evicts the least recently used variants first.
+
+Configure the displays in config.ini, in desktop order:
+   [Displays]
+   sizes = 2560x1600, 1920x1080
+   cache_max_mb = 2048
+
+Pre-render variants for the whole library with:
+   python generate-wallpaper.py derive
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import telemetry
+
+CACHE_DIR = "derivatives"
+INDEX_FILE = "index.db"
+DEFAULT_MAX_MB = 2048
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS variants (
+    path TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS variants_used_at ON variants (used_at);
+"""
+
+def parse_sizes(value):
+    """'2560x1600, 1920x1080' -> [(2560, 1600), (1920, 1080)]"""
+    sizes = []
+    for entry in (value or "").split(","):
+        if entry.strip():
+            width, height = entry.strip().lower().split("x")
+            sizes.append((int(width), int(height)))
+    return sizes
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:32]
+
+def render_variant(source, size, output):
+    """Resize and centre-crop `source` to fill `size`. Runs in worker processes."""
+    from PIL import Image, ImageOps
+
+    partial_path = f"{output}.part"
+    with Image.open(source) as image:
+        ImageOps.fit(image.convert("RGB"), size, Image.LANCZOS).save(partial_path, "PNG")
+    os.replace(partial_path, output)
+    return os.path.getsize(output)
+
+class DerivativeCache:
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_MB * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(directory, INDEX_FILE), check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+
+    def source_hash(self, source):
+        """Hash a source image, reusing the stored hash while its size and mtime are unchanged."""
+        stat = os.stat(source)
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT hash FROM sources WHERE path = ? AND mtime_ns = ? AND size = ?",
+                (source, stat.st_mtime_ns, stat.st_size)
+            ).fetchone()
+        if row:
+            return row[0]
+        digest = file_hash(source)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sources (path, mtime_ns, size, hash) VALUES (?, ?, ?, ?)",
+                (source, stat.st_mtime_ns, stat.st_size, digest)
+            )
+        return digest
+
+    def variant_path(self, digest, size):
+        return os.path.join(self.directory, f"{digest}_{size[0]}x{size[1]}.png")
+
+    def _missing(self, source, sizes):
+        """Return the variant path per size and the (size, path) pairs that still need rendering."""
+        digest = self.source_hash(source)
+        paths = [self.variant_path(digest, size) for size in sizes]
+        now = time.time()
+        missing = []
+        with self.lock, self.conn:
+            for size, path in zip(sizes, paths):
+                if os.path.exists(path):
+                    self.conn.execute("UPDATE variants SET used_at = ? WHERE path = ?", (now, path))
+                else:
+                    missing.append((size, path))
+        telemetry.count("cache", len(paths) - len(missing), cache="derivatives", outcome="hit")
+        telemetry.count("cache", len(missing), cache="derivatives", outcome="miss")
+        return paths, missing
+
+    def _store(self, source, path, size_bytes):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO variants (path, source, bytes, used_at) VALUES (?, ?, ?, ?)",
+                (path, source, size_bytes, time.time())
+            )
+
+    def variants_for(self, source, sizes):
+        """Return one variant path per display size, rendering any that are missing."""
+        source = os.path.abspath(source)
+        paths, missing = self._missing(source, sizes)
+        for size, path in missing:
+            self._store(source, path, render_variant(source, size, path))
+        if missing:
+            self.evict(keep=paths)
+        return paths
+
+    def render_many(self, sources, sizes, workers=None):
+        """Render every missing variant for `sources` in a process pool. Returns the number rendered."""
+        from concurrent.futures import ProcessPoolExecutor
+
+        rendered = 0
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = []
+            for source in sources:
+                source = os.path.abspath(source)
+                _, missing = self._missing(source, sizes)
+                for size, path in missing:
+                    futures.append((source, path, executor.submit(render_variant, source, size, path)))
+            for source, path, future in futures:
+                try:
+                    self._store(source, path, future.result())
+                    rendered += 1
+                except Exception as e:
+                    print(f"Failed to render {path} from {source}: {str(e)}")
+        self.evict()
+        return rendered
+
+    def move_source(self, old_source, new_source):
+        """Carry the variants of `old_source` over to a losslessly re-encoded copy at `new_source`.
+
+        The pixels are unchanged, so the variants rendered from the old file stay valid.
+        """
+        old_source, new_source = os.path.abspath(old_source), os.path.abspath(new_source)
+        stat = os.stat(new_source)
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT hash FROM sources WHERE path = ?", (old_source,)).fetchone()
+            if row is None:
+                return
+            if new_source != old_source:
+                self.conn.execute("DELETE FROM sources WHERE path = ?", (old_source,))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sources (path, mtime_ns, size, hash) VALUES (?, ?, ?, ?)",
+                (new_source, stat.st_mtime_ns, stat.st_size, row[0])
+            )
+            self.conn.execute("UPDATE variants SET source = ? WHERE source = ?", (new_source, old_source))
+
+    def source_of(self, path):
+        """Map a variant back to the wallpaper it was rendered from (or return `path` unchanged)."""
+        with self.lock:
+            row = self.conn.execute("SELECT source FROM variants WHERE path = ?", (path,)).fetchone()
+        return row[0] if row else path
+
+    def evict(self, keep=()):
+        """Delete least recently used variants until the cache fits in max_bytes."""
+        with self.lock, self.conn:
+            total = self.conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM variants").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            for path, size_bytes in self.conn.execute("SELECT path, bytes FROM variants ORDER BY used_at").fetchall():
+                if total <= self.max_bytes:
+                    break
+                if path in keep:
+                    continue
+                if os.path.exists(path):
+                    os.remove(path)
+                self.conn.execute("DELETE FROM variants WHERE path = ?", (path,))
+                total -= size_bytes
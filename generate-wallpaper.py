@@ -1,162 +1,496 @@
 #!env python3
-import os, re, requests, sys, glob, random, subprocess, io, argparse, json
-from PIL import Image, PngImagePlugin
+import os, re, sys, subprocess, argparse, json, threading, time, random
 from datetime import datetime
-from openai import OpenAI
-import weather_data
+import library
+import daemon
+import telemetry
+# openai, prompts, job_queue, weather_data, pngtext, transport (requests) and concurrent.futures are imported inside the
+# commands that use them, so the frequent `rotate` job starts without loading them
 
-def rand_choice(current_item, items_list):
-  if len(set(items_list)) <= 1:
-    return current_item
+class RateLimiter:
+  """Space out API calls so at most `per_minute` start in any minute, across threads."""
+  def __init__(self, per_minute=None):
+    self.interval = 60.0 / per_minute if per_minute else 0
+    self.next_slot = 0.0
+    self.lock = threading.Lock()
 
-  random_item = random.choice(items_list)
-  if (random_item == current_item):
-    return(rand_choice(current_item, items_list))
-  else:
-    return(random_item)
+  def wait(self):
+    if not self.interval:
+      return
+    with self.lock:
+      now = time.monotonic()
+      slot = max(now, self.next_slot)
+      self.next_slot = slot + self.interval
+    if slot > now:
+      time.sleep(slot - now)
+
+def get_library():
+  return library.open_library(os.path.join(os.path.dirname(os.path.realpath(__file__)), library.LIBRARY_FILE))
+
+def get_job_queue():
+  import job_queue
+  return job_queue.open_queue(os.path.join(os.path.dirname(os.path.realpath(__file__)), job_queue.QUEUE_FILE))
+
+def read_config():
+  import configparser
+  config = configparser.ConfigParser()
+  config.read(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'config.ini'))
+  return config
+
+_derivative_cache = None
+_derivative_cache_lock = threading.Lock()
+
+def get_derivative_cache():
+  # Returns the variant cache and the configured display sizes, or (None, []) without a [Displays] section
+  global _derivative_cache
+  with _derivative_cache_lock:
+    if _derivative_cache is None:
+      config = read_config()
+      sizes_value = config.get('Displays', 'sizes', fallback='')
+      cache, sizes = None, []
+      if sizes_value:
+        import derivatives
+        sizes = derivatives.parse_sizes(sizes_value)
+        cache = derivatives.DerivativeCache(
+          os.path.join(os.path.dirname(os.path.realpath(__file__)), derivatives.CACHE_DIR),
+          config.getint('Displays', 'cache_max_mb', fallback=derivatives.DEFAULT_MAX_MB) * 1024 * 1024
+        )
+      _derivative_cache = (cache, sizes)
+    return _derivative_cache
 
 def fetch_current_wallpaper():
   try:
     script = 'tell app "finder" to get posix path of (get desktop picture as alias)'
     p = subprocess.check_output(['osascript', '-e', script])
-    return(p.decode("utf-8").strip())
+    current = p.decode("utf-8").strip()
   except Exception:
     return("")
+  # A per-display variant stands in for the wallpaper it was rendered from
+  cache, sizes = get_derivative_cache()
+  return(cache.source_of(current) if sizes else current)
 
 def change_wallpaper(wallpaper):
+  cache, sizes = get_derivative_cache()
+  if sizes:
+    with telemetry.span("variants"):
+      variants = cache.variants_for(wallpaper, sizes)
+    with telemetry.span("set_wallpaper"):
+      for desktop, variant in enumerate(variants, 1):
+        cmd = f"""
+osascript -e "tell application \\"System Events\\" to set picture of desktop {desktop} to \\"{variant}\\" as POSIX file"
+"""
+        os.system(cmd)
+    return
+
   cmd = f"""
 osascript -e "tell application \\"System Events\\" to tell every desktop to set picture to \\"{wallpaper}\\" as POSIX file"
 """
-  os.system(cmd)
+  with telemetry.span("set_wallpaper"):
+    os.system(cmd)
+
+def drop_duplicate_images(image_paths, threshold):
+  import dedupe
+
+  # Only images already hashed (by `dedupe` or earlier runs) are compared against
+  wallpaper_library = get_library()
+  kept = []
+  for image_path in image_paths:
+    matches = dedupe.check_new_image(wallpaper_library, image_path, threshold)
+    if matches:
+      print(f"Removed {image_path}, a near-duplicate of {matches[0]}")
+      dedupe.remove_image(wallpaper_library, image_path)
+    else:
+      kept.append(image_path)
+  return kept
+
+_reuse_policy = None
+_reuse_policy_lock = threading.Lock()
+
+def get_reuse_policy():
+  # [Reuse] in config.ini: how old a reusable image may be, and how often a hit is reused instead of paid for
+  global _reuse_policy
+  with _reuse_policy_lock:
+    if _reuse_policy is None:
+      config = read_config()
+      _reuse_policy = {
+        "max_age": config.getfloat('Reuse', 'freshness_days', fallback=30) * 24 * 3600,
+        "ratio": config.getfloat('Reuse', 'reuse_ratio', fallback=0.5)
+      }
+    return _reuse_policy
+
+def reuse_existing(kind, key):
+  policy = get_reuse_policy()
+  if not key or random.random() >= policy["ratio"]:
+    return None
+  reused = get_library().recall(kind, key, policy["max_age"])
+  telemetry.count("cache", cache=f"reuse_{kind}", outcome="hit" if reused else "miss")
+  return reused
+
+def render_display_variants(wallpapers):
+  cache, sizes = get_derivative_cache()
+  if sizes and wallpapers:
+    rendered = cache.render_many(wallpapers, sizes)
+    print(f"Rendered {rendered} display variant(s).")
+
+def get_compact_settings():
+  # [Compact] in config.ini: the format `compact` converts to, and whether generate compacts its new images
+  config = read_config()
+  return {
+    "format": config.get('Compact', 'format', fallback='png'),
+    "after_generate": config.getboolean('Compact', 'after_generate', fallback=False),
+    "workers": config.getint('Compact', 'workers', fallback=None)
+  }
+
+def compact_images(image_paths, image_format, workers=None):
+  """Compact images, skipping the current wallpaper. Returns {old_path: new_path} for renamed images."""
+  import compact
+
+  current = fetch_current_wallpaper()
+  image_paths = [path for path in image_paths if path != current]
+  start = time.perf_counter()
+  with telemetry.span("compact"):
+    cache, sizes = get_derivative_cache()
+    stats = compact.compact_library(get_library(), image_paths, image_format, workers, cache if sizes else None)
+  seconds = max(time.perf_counter() - start, 1e-6)
+  saved = stats["bytes_before"] - stats["bytes_after"]
+  telemetry.count("compact_saved_bytes", saved, format=image_format)
+  megabytes = 1024 * 1024
+  print(f"Compacted {stats['images']} image(s) to {image_format}: {stats['bytes_before'] / megabytes:.1f} MB -> "
+        f"{stats['bytes_after'] / megabytes:.1f} MB, saved {saved / megabytes:.1f} MB "
+        f"({100 * saved / max(stats['bytes_before'], 1):.1f}%) in {seconds:.1f}s "
+        f"({stats['images'] / seconds:.1f} images/s, {stats['bytes_before'] / megabytes / seconds:.1f} MB/s).")
+  return stats["renamed"]
+
+_filenames_taken = set()
+_filenames_lock = threading.Lock()
 
 def generate_filename(directory_path, prompt):
   safe_filename = re.sub(r'[^\w\s]', '', prompt.replace(' ', '_'))
   trimmed_filename = safe_filename[:220]
   timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
   filename = f"{directory_path}/{trimmed_filename}_{timestamp}"
-  return(filename)
+  # Concurrent workers can finish the same prompt within a second, number the later ones
+  with _filenames_lock:
+    candidate, number = filename, 1
+    while candidate in _filenames_taken or os.path.exists(f"{candidate}.png") or os.path.exists(f"{candidate}.json"):
+      number += 1
+      candidate = f"{filename}_{number}"
+    _filenames_taken.add(candidate)
+  return(candidate)
+
+def generate_image(client, prompt, directory_path, metadata=None):
+  import pngtext, transport
+
+  reused = reuse_existing("prompt", prompt)
+  if reused:
+    print(f"Reusing existing wallpaper for prompt: {prompt}")
+    return reused
 
-def generate_image(client, prompt, directory_path):
   print("Generating Image from prompt:")
   print(prompt)
-  response = client.images.generate(
-    model="dall-e-3",
-    prompt=prompt,
-    size="1792x1024",
-    quality="hd",
-    n=1
-  )
-
-  generatedImage = requests.get(response.data[0].url).content
-  filename = generate_filename(directory_path, prompt)
-  newImage = Image.open(io.BytesIO(generatedImage))
-
-  pngMetaData = PngImagePlugin.PngInfo()
-  pngMetaData.add_text('Image Prompt', prompt)
-  pngMetaData.add_text('Revised Prompt', response.data[0].revised_prompt)
+  with telemetry.span("dalle"):
+    response = client.images.generate(
+      model="dall-e-3",
+      prompt=prompt,
+      size="1792x1024",
+      quality="hd",
+      n=1
+    )
+  telemetry.count("api_calls", api="images")
+  telemetry.count("cost_usd", telemetry.image_cost("dall-e-3", "hd", "1792x1024"), api="images")
 
+  filename = generate_filename(directory_path, prompt)
   image_filename = f"{filename}.png"
-  newImage.save(image_filename, pnginfo=pngMetaData)
+  # The download and the PNG metadata splice are one streaming pass
+  with telemetry.span("download"):
+    image_response = transport.get(response.data[0].url, stream=True)
+    image_response.raise_for_status()
+
+    # Stream straight to disk, splicing the prompts in as PNG text chunks
+    with image_response:
+      pngtext.save_png_with_text(image_response.iter_content(chunk_size=transport.DOWNLOAD_CHUNK_SIZE), image_filename, {
+        'Image Prompt': prompt,
+        'Revised Prompt': response.data[0].revised_prompt
+      })
+  telemetry.count("download_bytes", os.path.getsize(image_filename), source="images")
   # Create JSON file with extra information
   json_data = {
     "prompt": prompt,
     "filename": image_filename,
     "description": response.data[0].revised_prompt,
-    "command": " ".join(sys.argv)
+    "command": " ".join(sys.argv),
+    **(metadata or {})
   }
   json_filename = f"{filename}.json"
-  with open(json_filename, 'w') as json_file:
-    json.dump(json_data, json_file, indent=2)
+  with telemetry.span("index"):
+    with open(json_filename, 'w') as json_file:
+      json.dump(json_data, json_file, indent=2)
+    get_library().add(image_filename, json_data)
 
   return image_filename
 
-def generate_prompts(client, count, prompt):
-  response = client.chat.completions.create(
-    model="gpt-4o",
-    messages=[
-      {"role": "system", "content": "You are a creative assistant specialized in generating unique, special, random, and mesmerizing prompts for wallpaper creation using DALL-E 3."},
-      {"role": "system", "content": "Each prompt should be a standalone idea for a wallpaper, with no additional text or empty spaces between prompts."},
-      {"role": "system", "content": "Generate %s prompts for me. Ensure each prompt is unique, captivating, and suitable for creating stunning wallpapers." % (count)},
-      {"role": "system", "content": "Consider various themes such as nature, abstract art, futuristic landscapes, and surreal scenes. Make sure the prompts are diverse and imaginative."},
-      {"role": "user", "content": prompt}
-    ]
-  )
-  return response.choices[0].message.content
+def stream_prompts(client, count, prompt, concurrency=4):
+  # Prompts are streamed one by one, so the first image starts as soon as the first prompt is written
+  import prompts
+  return prompts.batched_prompts(client, count, prompt, get_library().prompts(), concurrency=concurrency)
+
+def generate_prompts(client, count, prompt, concurrency=4):
+  return list(stream_prompts(client, count, prompt, concurrency))
+
+def parse_cities(values):
+    # Each --city value is a comma separated list, or @path to a file with one city per line
+    cities = []
+    for value in values or []:
+        if value.startswith("@"):
+            with open(value[1:], 'r') as cities_file:
+                entries = [line for line in cities_file.read().splitlines() if not line.lstrip().startswith("#")]
+        else:
+            entries = value.split(",")
+        cities.extend(entry.strip() for entry in entries if entry.strip())
+    return cities
+
+CITY_PROMPT_SUFFIX = " Do not include any text in the image. Avoid using known landmarks or places."
+# HD images pregenerated per forecast refresh at most, in case the forecast keeps flipping
+MAX_TRANSITIONS = 4
 
 def handle_city_based_generation(client, city, directory_path, generated_images):
+    import weather_data
+
     print(f"Fetching weather data for {city}...")
     current_data = weather_data.fetch_weather(city)
     if current_data:
         print("Weather data successfully fetched.")
+        key = weather_data.weather_key(current_data)
+        reused = reuse_existing("weather", key)
+        if reused:
+            print(f"Reusing existing wallpaper for the same weather: {reused}")
+            generated_images.append(reused)
+            return
         print("Generating prompt using GPT-4...")
         prompt = weather_data.generate_gpt4_prompt(client, current_data, "current")
         print("Generated Prompt:")
         print(prompt)
-        image_path = generate_image(client, f"{prompt} Do not include any text in the image. Avoid using known landmarks or places.", directory_path)
+        image_path = generate_image(client, f"{prompt}{CITY_PROMPT_SUFFIX}", directory_path, {"city": city, "weather_key": key})
         generated_images.append(image_path)
     else:
         print("Failed to generate prompt due to missing weather data.")
 
-def handle_random_generation(client, count, directory_path, generated_images):
+def pregenerate_city_wallpapers(client, city, directory_path, lookahead_hours, max_transitions=MAX_TRANSITIONS):
+    """Have a wallpaper ready for every weather change in the next `lookahead_hours` hours.
+
+    Reads the hourly forecast, finds the hours where the weathercode, season or
+    day/night changes and generates a wallpaper for each one that has no image
+    in the library yet, nearest first. At most `max_transitions` new images are
+    generated per run, the schedule stops at the first change beyond that.
+    Returns [(unix_time, image_path)] in time order; the first entry is the
+    weather right now.
+    """
+    import weather_data
+
+    print(f"Fetching the hourly forecast for {city}...")
+    hourly_weather = weather_data.fetch_hourly_forecast(city, lookahead_hours)
+    if not hourly_weather:
+        print("Failed to pregenerate due to missing forecast data.")
+        return []
+
+    schedule = []
+    generated = 0
+    for hour in weather_data.find_transitions(hourly_weather):
+        key = weather_data.weather_key(hour)
+        image_path = get_library().recall("weather", key, get_reuse_policy()["max_age"])
+        if not image_path:
+            if generated >= max_transitions:
+                print(f"Generated {generated} wallpaper(s), leaving the changes from {time.strftime('%H:%M', time.localtime(hour['time']))} on for the next run.")
+                break
+            generated += 1
+            conditions = {name: value for name, value in hour.items() if name != "time"}
+            try:
+                prompt = weather_data.generate_gpt4_prompt(client, conditions, "forecast")
+                image_path = generate_image(client, f"{prompt}{CITY_PROMPT_SUFFIX}", directory_path, {"city": city, "weather_key": key})
+            except Exception as e:
+                print(f"Failed to pregenerate the wallpaper for {hour['weather_description']} at {time.strftime('%H:%M', time.localtime(hour['time']))}: {str(e)}")
+                continue
+        schedule.append((hour["time"], image_path))
+    return schedule
+
+def handle_cities_generation(client, cities, directory_path, generated_images, concurrency=1):
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        # Every city gets its own list so results stay in the order the cities were given
+        futures = []
+        for city in cities:
+            city_images = []
+            futures.append((city, city_images, executor.submit(handle_city_based_generation, client, city, directory_path, city_images)))
+        for city, city_images, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Failed to generate wallpaper for {city}: {str(e)}")
+            generated_images.extend(city_images)
+
+def handle_prompt_generation(client, count, prompt, directory_path, generated_images, concurrency=1, rate_limit=None, stream=True):
+    if stream:
+        prompts = stream_prompts(client, count, prompt, concurrency)
+    else:
+        prompts = generate_prompts(client, count, prompt, concurrency)
+    generate_images_from_prompts(client, prompts, directory_path, generated_images, concurrency, rate_limit)
+
+RANDOM_PROMPT = "Create a visually stunning wallpaper that is both professional and captivating. The wallpaper should be versatile enough to be used in various settings, including work environments. Consider themes such as nature, abstract art, and futuristic landscapes."
+
+def handle_random_generation(client, count, directory_path, generated_images, concurrency=1, rate_limit=None, stream=True):
     print(f"Generating you {count} random image prompts.")
-    input_prompt = "Create a visually stunning wallpaper that is both professional and captivating. The wallpaper should be versatile enough to be used in various settings, including work environments. Consider themes such as nature, abstract art, and futuristic landscapes."
-    prompts = generate_prompts(client, count, input_prompt)
-    generate_images_from_prompts(client, prompts, directory_path, generated_images)
+    handle_prompt_generation(client, count, RANDOM_PROMPT, directory_path, generated_images, concurrency, rate_limit, stream)
+
+def generate_images_from_prompts(client, prompts, directory_path, generated_images, concurrency=1, rate_limit=None):
+    import job_queue
+
+    if isinstance(prompts, str):
+        prompts = prompts.split("\n")
+    # Every prompt goes through the persistent queue first, so an interrupted batch can be resumed
+    batch = job_queue.new_batch()
+    print(f"Queued as batch {batch}; if interrupted, resume with `queue drain --batch {batch}`.")
+    drain_queue(client, batch, concurrency, rate_limit, prompts, directory_path)
+    generated_images.extend(job["output"] for job in get_job_queue().jobs(batch, "done"))
+
+def drain_queue(client, batch=None, concurrency=1, rate_limit=None, prompts=None, directory_path=None):
+    """Generate queued jobs (of one batch, if given) until none are pending.
+
+    `prompts`, if given, are added to `batch` while the workers run, so jobs start
+    as soon as a streamed prompt arrives. Failed jobs are retried after their
+    backoff; jobs still in-flight in another process are left to that process.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    queue = get_job_queue()
+    recovered = queue.recover()
+    if recovered:
+        print(f"Resuming {recovered} job(s) left in-flight by an earlier run.")
+    limiter = RateLimiter(rate_limit)
+    producing = threading.Event()
+    enqueued = threading.Event()
+    if prompts is not None:
+        producing.set()
+
+    def run(job):
+        limiter.wait()
+        try:
+            image_path = generate_image(client, job["prompt"], job["directory"], job["metadata"])
+        except Exception as e:
+            status = queue.fail(job, str(e))
+            print(f"Failed to generate image for prompt '{job['prompt']}' ({'will retry' if status == 'pending' else 'giving up'}): {str(e)}")
+            return
+        indexed = get_library().get(image_path) or {}
+        queue.complete(job["id"], image_path, indexed.get("description"))
 
-def generate_images_from_prompts(client, prompts, directory_path, generated_images):
-    for prompt in prompts.split("\n"):
-        if prompt.strip():
-            image_path = generate_image(client, prompt, directory_path)
-            generated_images.append(image_path)
+    def worker():
+        while True:
+            job = queue.claim(batch)
+            if job:
+                run(job)
+            elif producing.is_set():
+                enqueued.wait(0.5)
+                enqueued.clear()
+            else:
+                due = queue.next_due(batch)
+                if due is None:
+                    return
+                time.sleep(min(max(0, due - time.time()), 1))
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        workers = [executor.submit(worker) for _ in range(max(1, concurrency))]
+        try:
+            for prompt in prompts or []:
+                if prompt.strip():
+                    queue.enqueue(prompt.strip(), directory_path, batch)
+                    enqueued.set()
+        finally:
+            producing.clear()
+            enqueued.set()
+        for future in workers:
+            future.result()
+
+def fetch_latest_release():
+    import transport
 
-def fetch_latest_city_wallpaper(city, directory_path):
     # GitHub API endpoint for latest release
     owner = "theonlysinjin"
     repo = "wallpaper-generator"
     api_url = f"https://api.github.com/repos/{owner}/{repo}/releases/latest"
-    
+
+    # Conditional request: a 304 is free against the rate limit and means the stored release is current
+    cached = get_library().release(api_url)
+    headers = {}
+    if cached and cached["etag"]:
+        headers["If-None-Match"] = cached["etag"]
+    if cached and cached["last_modified"]:
+        headers["If-Modified-Since"] = cached["last_modified"]
+
+    with telemetry.span("release"):
+        response = transport.get(api_url, headers=headers)
+    telemetry.count("api_calls", api="github")
+    telemetry.count("cache", cache="release", outcome="hit" if response.status_code == 304 else "miss")
+    if response.status_code == 304 and cached:
+        return cached["body"]
+    response.raise_for_status()
+    release_data = response.json()
+    get_library().save_release(api_url, response.headers.get("ETag"), response.headers.get("Last-Modified"), release_data)
+    return release_data
+
+def download_city_asset(release_data, city, directory_path):
+    import transport
+
     try:
-        # Get latest release info
-        response = requests.get(api_url)
-        response.raise_for_status()
-        release_data = response.json()
-        
         # Get the release tag name and normalise
         tag_name = release_data.get('tag_name', 'unknown').replace("generate/", "")
         city_name = city.replace(" ", ".")
         
-        # Check for existing file with this tag
-        existing_files = glob.glob(os.path.join(directory_path, f"*{city_name}*{tag_name}.png"))
-        if existing_files:
+        # Check the library index for an existing file with this tag
+        city_library = get_library()
+        existing_file = city_library.find(city_name, tag_name)
+        if existing_file:
             print(f"Found existing wallpaper for {city} with tag {tag_name}")
-            return existing_files[0]
+            return existing_file
         
         for asset in release_data['assets']:
             if city_name in asset['name'] and asset['name'].endswith('.png'):
-                # Download the asset
-                download_url = asset['browser_download_url']
-                image_response = requests.get(download_url)
-                image_response.raise_for_status()
-                
                 # Modify filename to include tag name
                 base_name = os.path.splitext(asset['name'])[0]
                 new_filename = f"{base_name}_{tag_name}.png"
                 
-                # Save to local directory
+                # Download the asset, resuming any partial download from an earlier tick
                 local_path = os.path.join(directory_path, new_filename)
-                with open(local_path, 'wb') as f:
-                    f.write(image_response.content)
+                with telemetry.span("asset_download"):
+                    transport.download(asset['browser_download_url'], local_path, asset.get('size'), asset.get('digest'))
+                telemetry.count("download_bytes", os.path.getsize(local_path), source="release")
+                city_library.add(local_path, {"city": city, "tag": tag_name, "asset": asset['name']})
                 return local_path
 
         print(f"No wallpaper found for {city} in the latest release")
         return None
     except Exception as e:
-        print(f"Error fetching wallpaper: {str(e)}")
+        print(f"Error fetching wallpaper for {city}: {str(e)}")
         return None
 
+def fetch_latest_city_wallpapers(cities, directory_path, concurrency=1):
+    from concurrent.futures import ThreadPoolExecutor
+
+    # Read the latest release once and download every city's asset in parallel
+    try:
+        release_data = fetch_latest_release()
+    except Exception as e:
+        print(f"Error fetching wallpaper: {str(e)}")
+        return {city: None for city in cities}
+
+    with telemetry.span("sync"):
+        get_library().sync(directory_path)
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = {city: executor.submit(download_city_asset, release_data, city, directory_path) for city in cities}
+        return {city: future.result() for city, future in futures.items()}
+
 def handle_service_management(args):
     # Update list of possible plist files
-    plist_files = ['generate-rotate.plist', 'generate-city.plist', 'fetch-city.plist']
+    plist_files = ['generate-rotate.plist', 'generate-city.plist', 'fetch-city.plist', 'daemon.plist']
 
     if args.command in ["uninstall", "reinstall"]:
         uninstall_services(plist_files)
@@ -188,7 +522,9 @@ def uninstall_service(plist_path, plist_file):
         print(f"Try running `sudo launchctl unload -w {plist_path}` for richer errors.")
 def install_service(args):
     # Determine which plist file to use based on arguments
-    if args.city:
+    if getattr(args, 'daemon', False):
+        plist_file = 'daemon.plist'
+    elif args.city:
         if getattr(args, 'generate', False):
             plist_file = 'generate-city.plist'
         else:
@@ -209,6 +545,14 @@ def install_service(args):
     plist_content = plist_content.replace('{{SCRIPT_PATH}}', script_path)
     if args.city:
         plist_content = plist_content.replace('{{CITY_NAME}}', args.city)
+    daemon_args = ["--city", args.city] if args.city else []
+    if getattr(args, 'generate', False):
+        daemon_args.append("--generate")
+    if getattr(args, 'lookahead', None):
+        daemon_args += ["--lookahead", str(args.lookahead)]
+    if getattr(args, 'max_transitions', None) is not None:
+        daemon_args += ["--max-transitions", str(args.max_transitions)]
+    plist_content = plist_content.replace('{{DAEMON_ARGS}}', "".join(f"\n        <string>{arg}</string>" for arg in daemon_args))
 
     with open(plist_path, 'w') as file:
         file.write(plist_content)
@@ -228,11 +572,187 @@ def install_service(args):
         print(f"Failed to load {plist_file}. Error: {result.stderr.strip()}")
         print(f"Try running `sudo launchctl load -w {plist_path}` for richer errors.")
 
-def rotate_wallpaper(directory_path):
-    wallpapers = glob.glob(os.path.join(directory_path, "*.png"))
-    wallpaper = rand_choice(fetch_current_wallpaper(), wallpapers)
-    change_wallpaper(wallpaper)
+def rotate_wallpaper(directory_path, city=None, prefer_recent=False):
+    wallpaper_library = get_library()
+    with telemetry.span("sync"):
+        wallpaper_library.sync(directory_path)
+    with telemetry.span("current_wallpaper"):
+        current = fetch_current_wallpaper()
+    with telemetry.span("next_image"):
+        wallpaper = wallpaper_library.next_image(directory_path, current, city, prefer_recent)
+    if wallpaper:
+        change_wallpaper(wallpaper)
+    return wallpaper
+
+def run_daemon(args, directory_path):
+    cities = parse_cities(args.city)
+    city_wallpaper_path = os.path.join(directory_path, "city")
+    os.makedirs(city_wallpaper_path, exist_ok=True)
+    clients = {}
+
+    def openai_client():
+        # Created on first use and kept for the life of the daemon
+        if "openai" not in clients:
+            from openai import OpenAI
+            clients["openai"] = OpenAI()
+        return clients["openai"]
+
+    def rotate_job():
+        return rotate_wallpaper(directory_path)
+
+    def fetch_job():
+        fetched = [path for path in fetch_latest_city_wallpapers(cities, city_wallpaper_path, len(cities)).values() if path]
+        if fetched:
+            change_wallpaper(fetched[0])
+            return fetched[0]
+
+    def generate_job():
+        generated_images = []
+        if cities:
+            handle_cities_generation(openai_client(), cities, directory_path, generated_images, len(cities))
+            if generated_images:
+                change_wallpaper(generated_images[-1])
+        else:
+            handle_random_generation(openai_client(), 1, directory_path, generated_images)
+        return generated_images[-1] if generated_images else None
+
+    def drain_job():
+        # Only a queue with pending jobs needs the OpenAI client (and an API key)
+        queue = get_job_queue()
+        queue.recover()
+        if queue.counts()["pending"]:
+            drain_queue(openai_client())
+        return queue.counts()
+
+    def switch_to(image_path):
+        change_wallpaper(image_path)
+        return image_path
+
+    def instrumented(name, func):
+        # Every job is one telemetry run, written out as soon as it finishes
+        def run():
+            try:
+                with telemetry.span(f"job:{name}"):
+                    return func()
+            finally:
+                telemetry.flush()
+        return run
+
+    def pregenerate_job():
+        # Wallpapers for the coming weather changes are made now and switched to when each change starts
+        schedule = pregenerate_city_wallpapers(openai_client(), cities[0], directory_path, args.lookahead, args.max_transitions)
+        scheduler.cancel("switch ")
+        for when, image_path in schedule:
+            scheduler.run_at(f"switch {time.strftime('%H:%M', time.localtime(when))}", instrumented("switch", lambda path=image_path: switch_to(path)), when)
+        return f"{len(schedule)} wallpaper(s) scheduled"
+
+    # The timed job mirrors the launchd job `install` would set up, the others run on request
+    scheduler = daemon.Daemon(args.socket)
+    timed_job = ("pregenerate" if args.lookahead else "generate" if args.generate else "fetch") if cities else "rotate"
+    scheduler.add_job("rotate", instrumented("rotate", rotate_job), args.interval if timed_job == "rotate" else None)
+    if cities:
+        scheduler.add_job("fetch", instrumented("fetch", fetch_job), args.interval if timed_job == "fetch" else None)
+    scheduler.add_job("generate", instrumented("generate", generate_job), args.interval if timed_job == "generate" else None)
+    if cities and args.lookahead:
+        scheduler.add_job("pregenerate", instrumented("pregenerate", pregenerate_job), args.interval)
+    scheduler.add_job("drain", instrumented("drain", drain_job))
+    scheduler.serve_forever()
+
 
+def handle_queue_command(args, directory_path):
+    import job_queue
+
+    queue = get_job_queue()
+    if args.queue_command == "enqueue":
+        prompts = list(args.prompts)
+        if not sys.stdin.isatty():
+            prompts += sys.stdin.read().splitlines()
+        if args.count:
+            from openai import OpenAI
+            load_api_key()
+            prompts += generate_prompts(OpenAI(), args.count, args.prompt or RANDOM_PROMPT)
+        prompts = [prompt.strip() for prompt in prompts if prompt.strip()]
+        if not prompts:
+            print("Nothing to queue: pass prompts, pipe them in or use --count.")
+            return
+        batch = job_queue.new_batch()
+        for prompt in prompts:
+            queue.enqueue(prompt, directory_path, batch)
+        print(f"Queued {len(prompts)} prompt(s) as batch {batch}. Run `queue drain` to generate them.")
+
+    elif args.queue_command == "list":
+        if args.batch or args.status:
+            for job in queue.jobs(args.batch, args.status, args.limit):
+                detail = job["output"] or job["error"] or ""
+                print(f"{job['id']:>6}  {job['status']:<9}  {job['attempts']}x  {job['prompt'][:60]:<60}  {detail}")
+        else:
+            for batch, counts in queue.batches().items():
+                print(f"{batch}  " + ", ".join(f"{count} {status}" for status, count in counts.items() if count))
+        print("Total: " + ", ".join(f"{count} {status}" for status, count in queue.counts(args.batch).items()))
+
+    elif args.queue_command == "drain":
+        if args.background:
+            command = [sys.executable, os.path.realpath(__file__), "queue", "drain", "--concurrency", str(args.concurrency)]
+            if args.batch:
+                command += ["--batch", args.batch]
+            if args.rate_limit:
+                command += ["--rate-limit", str(args.rate_limit)]
+            log_path = "/tmp/wallpaperchanger-queue.log"
+            with open(log_path, "a") as log:
+                process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+            print(f"Draining in the background (pid {process.pid}), output goes to {log_path}.")
+            return
+        from openai import OpenAI
+        load_api_key()
+        before = {job["id"] for job in queue.jobs(args.batch, "done")}
+        drain_queue(OpenAI(), args.batch, args.concurrency, args.rate_limit)
+        generated_images = [job["output"] for job in queue.jobs(args.batch, "done") if job["id"] not in before]
+        render_display_variants(generated_images)
+        counts = queue.counts(args.batch)
+        print(f"Generated {len(generated_images)} image(s); {counts['failed']} failed, {counts['in-flight']} still in-flight elsewhere.")
+
+    elif args.queue_command == "retry":
+        print(f"Retrying {queue.retry_failed(args.batch)} failed job(s).")
+
+    elif args.queue_command == "clear":
+        print(f"Deleted {queue.clear(args.batch)} finished job(s).")
+
+def print_stats(runs, since_hours=None):
+    recorder = telemetry.recorder()
+    since = time.time() - since_hours * 3600 if since_hours else None
+    stages, counters = telemetry.summarise(telemetry.read_log(recorder.log_path, since), runs)
+    if not stages and not counters:
+        print(f"No telemetry recorded yet in {recorder.log_path}.")
+        return
+
+    print(f"{'stage':<24} {'count':>6} {'errors':>6} {'p50':>10} {'p95':>10} {'max':>10}")
+    for stage, summary in sorted(stages.items(), key=lambda item: -item[1]["p95"]):
+        print(f"{stage:<24} {summary['count']:>6} {summary['errors']:>6} "
+              + " ".join(f"{summary[field] * 1000:>8.1f}ms" for field in ("p50", "p95", "max")))
+    print()
+    for key, value in sorted(counters.items()):
+        if key.startswith("cost_usd"):
+            print(f"{key:<56} ${value:.2f}")
+        elif key.startswith(("download_bytes", "compact_saved_bytes")):
+            print(f"{key:<56} {value / (1024 * 1024):.1f} MB")
+        else:
+            print(f"{key:<56} {value:g}")
+    print(f"Estimated API cost: ${sum(v for k, v in counters.items() if k.startswith('cost_usd')):.2f}")
+
+def load_api_key(required=True):
+    # Only commands that call OpenAI need the key, so rotate never reads config.ini
+    if 'OPENAI_API_KEY' in os.environ:
+        return os.environ['OPENAI_API_KEY']
+
+    try:
+        openai_api_key = read_config()['OpenAI']['api_key']
+        os.environ['OPENAI_API_KEY'] = openai_api_key
+        return openai_api_key
+    except (FileNotFoundError, KeyError):
+        if required:
+            print("Error: OpenAI API key not found in environment or config.ini")
+            sys.exit(1)
+        return None
 
 def main():
     parser = argparse.ArgumentParser(description="Wallpaper Generator")
@@ -242,13 +762,21 @@ def main():
     generate_parser = subparsers.add_parser("generate", help="Generate images based on prompts")
     generate_parser.add_argument("--count", type=int, default=1, help="Number of prompts to generate (default: 1)")
     generate_parser.add_argument("--prompt", type=str, help="Custom prompt for generating images")
-    generate_parser.add_argument("--city", type=str, help="City name for weather-based prompt generation")
+    generate_parser.add_argument("--city", type=str, action="append", help="City name for weather-based prompt generation; repeat, comma separate or pass @file for several cities")
     generate_parser.add_argument("--rotate-now", action="store_true", help="Rotate wallpaper immediately after generation")
+    generate_parser.add_argument("--concurrency", type=int, default=4, help="Number of images to generate in parallel (default: 4)")
+    generate_parser.add_argument("--stream", action=argparse.BooleanOptionalAction, default=True, help="Start generating images while prompts are still streaming in (default: on)")
+    generate_parser.add_argument("--dedupe", action="store_true", help="Discard new images that nearly duplicate an existing one")
+    generate_parser.add_argument("--dedupe-threshold", type=int, default=6, help="Maximum perceptual hash distance counted as a duplicate, up to 11 (default: 6)")
+    generate_parser.add_argument("--no-reuse", action="store_true", help="Always generate, even when a fitting image already exists")
+    generate_parser.add_argument("--rate-limit", type=float, default=None, help="Maximum image requests started per minute (default: unlimited)")
+    generate_parser.add_argument("--compact", action=argparse.BooleanOptionalAction, default=None, help="Compact the new images afterwards (default: after_generate in [Compact])")
 
     # Fetch command
     fetch_parser = subparsers.add_parser("fetch", help="Fetch the most recent wallpaper for a city")
-    fetch_parser.add_argument("--city", type=str, required=True, help="City name to fetch wallpaper for")
+    fetch_parser.add_argument("--city", type=str, action="append", required=True, help="City name to fetch wallpaper for; repeat, comma separate or pass @file for several cities")
     fetch_parser.add_argument("--rotate-now", action="store_true", help="Rotate to the fetched wallpaper immediately")
+    fetch_parser.add_argument("--concurrency", type=int, default=8, help="Number of wallpapers to download in parallel (default: 8)")
 
     # Custom action to handle dynamic default intervals
     class IntervalAction(argparse.Action):
@@ -265,6 +793,10 @@ def main():
                               help="Interval in seconds between wallpaper rotations (default: 3600 for generate, 600 for fetch)")
     install_parser.add_argument("--city", type=str, help="City name for weather-based prompt generation")
 
+    install_parser.add_argument("--daemon", action="store_true", help="Install one resident daemon instead of interval jobs")
+    install_parser.add_argument("--lookahead", type=int, default=None, help="With --daemon and --city, generate wallpapers for the weather changes forecast in the next N hours ahead of time")
+    install_parser.add_argument("--max-transitions", type=int, default=None, help=f"With --lookahead, new wallpapers generated per forecast refresh at most (default: {MAX_TRANSITIONS})")
+
     # Uninstall command
     subparsers.add_parser("uninstall", help="Uninstall the plist files for automatic wallpaper rotation")
 
@@ -277,16 +809,86 @@ def main():
                                 default=None,
                                 help="Interval in seconds between wallpaper rotations (default: 3600 for generate, 600 for fetch)")
     reinstall_parser.add_argument("--city", type=str, help="City name for weather-based prompt generation")
+    reinstall_parser.add_argument("--daemon", action="store_true", help="Install one resident daemon instead of interval jobs")
+    reinstall_parser.add_argument("--lookahead", type=int, default=None, help="With --daemon and --city, generate wallpapers for the weather changes forecast in the next N hours ahead of time")
+    reinstall_parser.add_argument("--max-transitions", type=int, default=None, help=f"With --lookahead, new wallpapers generated per forecast refresh at most (default: {MAX_TRANSITIONS})")
+
+    # Daemon command
+    daemon_parser = subparsers.add_parser("daemon", help="Stay resident and run rotation, fetch or generation on timers")
+    daemon_parser.add_argument("--interval", type=int, default=None, help="Interval in seconds for the timed job (default: 3600 for generate, 600 otherwise)")
+    daemon_parser.add_argument("--city", type=str, action="append", help="Fetch (or with --generate, generate) wallpapers for these cities instead of rotating")
+    daemon_parser.add_argument("--generate", action="store_true", help="Generate new images instead of fetching them (only applies with --city)")
+    daemon_parser.add_argument("--lookahead", type=int, default=None, metavar="HOURS", help="With --city, generate wallpapers for the weather changes forecast in the next HOURS hours ahead of time and switch when each change starts")
+    daemon_parser.add_argument("--max-transitions", type=int, default=MAX_TRANSITIONS, help=f"With --lookahead, new wallpapers generated per forecast refresh at most (default: {MAX_TRANSITIONS})")
+    daemon_parser.add_argument("--socket", type=str, default=None, help="Control socket path (default: in the temp directory)")
+    daemon_parser.add_argument("--send", type=str, metavar="COMMAND", help="Send a command (rotate, fetch, generate, status, stop) to the running daemon")
+
+    # Queue command
+    queue_parser = subparsers.add_parser("queue", help="Enqueue, inspect and drain persistent generation jobs")
+    queue_subparsers = queue_parser.add_subparsers(dest="queue_command", required=True)
+    enqueue_parser = queue_subparsers.add_parser("enqueue", help="Add prompts to the queue without generating them yet")
+    enqueue_parser.add_argument("prompts", nargs="*", help="Prompts to queue as they are (also read one per line from stdin)")
+    enqueue_parser.add_argument("--count", type=int, default=None, help="Generate this many prompts with GPT-4o and queue them")
+    enqueue_parser.add_argument("--prompt", type=str, default=None, help="Theme for the prompts generated with --count")
+    list_parser = queue_subparsers.add_parser("list", help="Show batches, or the jobs of one batch")
+    list_parser.add_argument("--batch", type=str, help="Show the jobs of this batch")
+    list_parser.add_argument("--status", type=str, choices=["pending", "in-flight", "done", "failed"], help="Only show jobs with this status")
+    list_parser.add_argument("--limit", type=int, default=50, help="Maximum jobs shown (default: 50)")
+    drain_parser = queue_subparsers.add_parser("drain", help="Generate every pending job, resuming interrupted batches")
+    drain_parser.add_argument("--batch", type=str, help="Only drain this batch")
+    drain_parser.add_argument("--concurrency", type=int, default=4, help="Number of images to generate in parallel (default: 4)")
+    drain_parser.add_argument("--rate-limit", type=float, default=None, help="Maximum image requests started per minute (default: unlimited)")
+    drain_parser.add_argument("--background", action="store_true", help="Drain in a detached process and return immediately")
+    retry_parser = queue_subparsers.add_parser("retry", help="Make failed jobs pending again")
+    retry_parser.add_argument("--batch", type=str, help="Only retry this batch")
+    clear_parser = queue_subparsers.add_parser("clear", help="Delete done and failed jobs")
+    clear_parser.add_argument("--batch", type=str, help="Only clear this batch")
+
+    # Stats command
+    stats_parser = subparsers.add_parser("stats", help="Summarise per-stage latency and API usage from the telemetry log")
+    stats_parser.add_argument("--runs", type=int, default=50, help="Number of recent runs to include (default: 50, 0 for all)")
+    stats_parser.add_argument("--since", type=float, default=None, metavar="HOURS", help="Only include the last HOURS hours")
+
+    # Reindex command
+    subparsers.add_parser("reindex", help="Rebuild the wallpaper library index from the images on disk")
+
+    # Dedupe command
+    dedupe_parser = subparsers.add_parser("dedupe", help="Find near-duplicate wallpapers by perceptual hash")
+    dedupe_parser.add_argument("--threshold", type=int, default=6, help="Maximum hash distance counted as a duplicate, up to 11 (default: 6)")
+    dedupe_parser.add_argument("--delete", action="store_true", help="Delete the duplicates, keeping the oldest image of each group")
+    dedupe_parser.add_argument("--workers", type=int, default=None, help="Processes used for hashing (default: one per CPU)")
+
+    # Compact command
+    compact_parser = subparsers.add_parser("compact", help="Recompress wallpapers or convert them to lossless WebP")
+    compact_parser.add_argument("--format", type=str, choices=["png", "webp"], default=None, help="Target format (default: format in [Compact], or png)")
+    compact_parser.add_argument("--workers", type=int, default=None, help="Processes used for encoding (default: one per CPU)")
+
+    # Derive command
+    subparsers.add_parser("derive", help="Pre-render per-display variants of every wallpaper")
 
     # Rotate command (default behavior)
-    subparsers.add_parser("rotate", help="Rotate wallpaper")
+    rotate_parser = subparsers.add_parser("rotate", help="Rotate wallpaper")
+    rotate_parser.add_argument("--city", type=str, help="Prefer wallpapers generated for this city")
+    rotate_parser.add_argument("--prefer-recent", action="store_true", help="Show the newest unseen wallpaper first")
 
     args = parser.parse_args()
+    if args.command == "stats":
+        # Reading the telemetry isn't a run worth recording
+        run_command(args)
+        return
+    telemetry.recorder().command = args.command or "rotate"
+    with telemetry.span(f"command:{args.command or 'rotate'}"):
+        run_command(args)
 
+def run_command(args):
     directory_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "images")
     os.makedirs(directory_path, exist_ok=True)
 
     if args.command == "generate":
+        from openai import OpenAI
+        load_api_key()
+        if args.no_reuse:
+            get_reuse_policy()["ratio"] = 0
         client = OpenAI()
         count = args.count
 
@@ -294,20 +896,23 @@ def main():
 
         if not sys.stdin.isatty() and sys.stdin.read(1):
             sys.stdin.seek(0)
-            for line in sys.stdin:
-                prompt = line.strip()
-                if prompt:
-                    image_path = generate_image(client, prompt, directory_path)
-                    generated_images.append(image_path)
+            generate_images_from_prompts(client, sys.stdin, directory_path, generated_images, args.concurrency, args.rate_limit)
         else:
             if args.city:
-                handle_city_based_generation(client, args.city, directory_path, generated_images)
+                handle_cities_generation(client, parse_cities(args.city), directory_path, generated_images, args.concurrency)
             elif args.prompt:
-                prompts = generate_prompts(client, count, args.prompt)
-                generate_images_from_prompts(client, prompts, directory_path, generated_images)
+                handle_prompt_generation(client, count, args.prompt, directory_path, generated_images, args.concurrency, args.rate_limit, args.stream)
             else:
-                handle_random_generation(client, count, directory_path, generated_images)
+                handle_random_generation(client, count, directory_path, generated_images, args.concurrency, args.rate_limit, args.stream)
 
+        if args.dedupe:
+            import dedupe
+            generated_images[:] = drop_duplicate_images(generated_images, min(args.dedupe_threshold, dedupe.MAX_THRESHOLD))
+        settings = get_compact_settings()
+        if generated_images and (settings["after_generate"] if args.compact is None else args.compact):
+            renamed = compact_images(generated_images, settings["format"], settings["workers"])
+            generated_images[:] = [renamed.get(path, path) for path in generated_images]
+        render_display_variants(generated_images)
         if generated_images and args.rotate_now:
             new_wallpaper = generated_images[-1]
             change_wallpaper(new_wallpaper)
@@ -320,16 +925,68 @@ def main():
     elif args.command == "fetch":
         city_wallpaper_path = os.path.join(directory_path, "city")
         os.makedirs(city_wallpaper_path, exist_ok=True)
-        latest_wallpaper = fetch_latest_city_wallpaper(args.city, city_wallpaper_path)
+        cities = parse_cities(args.city)
+        latest_wallpapers = fetch_latest_city_wallpapers(cities, city_wallpaper_path, args.concurrency)
 
-        if latest_wallpaper:
-            if args.rotate_now:
-                change_wallpaper(latest_wallpaper)
-                print(f"Wallpaper changed to: {latest_wallpaper}")
+        for city, latest_wallpaper in latest_wallpapers.items():
+            if latest_wallpaper:
+                print(f"Most recent wallpaper for {city}: {latest_wallpaper}")
             else:
-                print(f"Most recent wallpaper for {args.city}: {latest_wallpaper}")
+                print(f"Failed to fetch wallpaper for {city}")
+
+        # With several cities, the first one that was fetched becomes the wallpaper
+        fetched = [path for path in latest_wallpapers.values() if path]
+        if fetched and args.rotate_now:
+            change_wallpaper(fetched[0])
+            print(f"Wallpaper changed to: {fetched[0]}")
+
+    elif args.command == "queue":
+        handle_queue_command(args, directory_path)
+
+    elif args.command == "stats":
+        print_stats(args.runs, args.since)
+
+    elif args.command == "reindex":
+        city_wallpaper_path = os.path.join(directory_path, "city")
+        indexed = get_library().reindex([directory_path, city_wallpaper_path])
+        print(f"Indexed {indexed} wallpaper(s).")
+
+    elif args.command == "dedupe":
+        import dedupe
+
+        wallpaper_library = get_library()
+        wallpaper_library.sync(directory_path)
+        threshold = min(args.threshold, dedupe.MAX_THRESHOLD)
+        print(f"Hashed {dedupe.index_hashes(wallpaper_library, directory_path, args.workers)} new image(s).")
+        groups = dedupe.find_duplicates(wallpaper_library, directory_path, threshold)
+        for original, duplicates in groups:
+            print(f"{original}")
+            for duplicate in duplicates:
+                print(f"  {'removed' if args.delete else 'duplicate'}: {duplicate}")
+                if args.delete:
+                    dedupe.remove_image(wallpaper_library, duplicate)
+        print(f"Found {sum(len(duplicates) for _, duplicates in groups)} near-duplicate(s) in {len(groups)} group(s).")
+
+    elif args.command == "compact":
+        settings = get_compact_settings()
+        image_format = args.format or settings["format"]
+        wallpaper_library = get_library()
+        image_paths = []
+        for directory in (directory_path, os.path.join(directory_path, "city")):
+            wallpaper_library.sync(directory)
+            image_paths += wallpaper_library.uncompacted_images(directory, image_format)
+        if not image_paths:
+            print(f"Every wallpaper is already compacted to {image_format}.")
+        else:
+            compact_images(image_paths, image_format, args.workers or settings["workers"])
+
+    elif args.command == "derive":
+        if not get_derivative_cache()[1]:
+            print("No display sizes configured. Add a [Displays] section with `sizes` to config.ini.")
         else:
-            print(f"Failed to fetch wallpaper for {args.city}")
+            wallpaper_library = get_library()
+            wallpaper_library.sync(directory_path)
+            render_display_variants(wallpaper_library.images(directory_path))
 
     ## Installation / Uninstallation ##
     elif args.command in ["install", "uninstall", "reinstall"]:
@@ -337,28 +994,35 @@ def main():
         if args.command in ['install', 'reinstall']:
             if args.interval is None:
                 args.interval = 3600 if args.generate else 600
+            if args.lookahead and len(parse_cities([args.city] if args.city else None)) > 1:
+                print("Error: --lookahead works with a single --city.")
+                sys.exit(1)
         
         handle_service_management(args)
     ##
 
+    elif args.command == "daemon":
+        if args.send:
+            reply = daemon.send_command(args.send, args.socket)
+            print(reply if reply is not None else "No daemon is running.")
+        else:
+            if args.interval is None:
+                args.interval = 3600 if args.generate else 600
+            if args.lookahead and len(parse_cities(args.city)) > 1:
+                # Every desktop shows the same wallpaper, so only one city's forecast can drive it
+                print("Error: --lookahead works with a single --city.")
+                sys.exit(1)
+            # Only a daemon that generates on a timer can't start without a key
+            load_api_key(required=bool(args.city and (args.generate or args.lookahead)))
+            run_daemon(args, directory_path)
+
     else:  # Default behavior (rotate)
-        rotate_wallpaper(directory_path)
+        city = getattr(args, "city", None)
+        prefer_recent = getattr(args, "prefer_recent", False)
+        # A running daemon rotates with its warm index, otherwise rotate in this process
+        reply = None if city or prefer_recent else daemon.send_command("rotate")
+        if reply is None:
+            rotate_wallpaper(directory_path, city, prefer_recent)
 
 if __name__ == '__main__':
-    import os
-
-    if 'OPENAI_API_KEY' in os.environ:
-        openai_api_key = os.environ['OPENAI_API_KEY']
-    else:
-        import configparser
-        config = configparser.ConfigParser()
-        config_path = os.path.join(os.path.dirname(__file__), 'config.ini')
-        try:
-            config.read(config_path)
-            openai_api_key = config['OpenAI']['api_key']
-            os.environ['OPENAI_API_KEY'] = openai_api_key
-        except (FileNotFoundError, KeyError):
-            print("Error: OpenAI API key not found in environment or config.ini")
-            sys.exit(1)
-
     main()
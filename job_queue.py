@@ -0,0 +1,239 @@
+"""
+Durable queue of image generation jobs.
+
+Every prompt of a batch is stored with its status before any money is spent on
+it, and updated as it moves through
+
+   pending -> in-flight -> done
+                       \\-> pending (retried after a backoff) -> ... -> failed
+
+so a batch that dies halfway can be resumed with `queue drain`: done prompts are
+never generated again. Claims happen inside an immediate SQLite transaction, so
+several workers (threads or processes) never take the same job. Jobs left
+in-flight by a process that no longer exists are put back to pending; for jobs
+claimed on another host, whose process can't be checked, after LEASE seconds,
+and for jobs whose process id is in use after LOCAL_LEASE seconds, in case the
+id was reused after a crash.
+"""
+
+import json
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+QUEUE_FILE = "job_queue.db"
+MAX_ATTEMPTS = 3
+BACKOFF_BASE = 15
+BACKOFF_CAP = 300
+# In-flight jobs claimed on another host are only recovered after this long
+LEASE = 30 * 60
+# Or on this host by a process id that is still in use, far longer than any generation takes
+LOCAL_LEASE = 6 * 3600
+STATUSES = ["pending", "in-flight", "done", "failed"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    batch TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    directory TEXT NOT NULL,
+    metadata TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    not_before REAL NOT NULL DEFAULT 0,
+    worker TEXT,
+    claimed_at REAL,
+    revised_prompt TEXT,
+    output TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, not_before);
+CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch, id);
+"""
+
+def new_batch():
+    return time.strftime("%Y%m%d%H%M%S-") + uuid.uuid4().hex[:6]
+
+def worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+def worker_alive(worker):
+    """Whether the process that claimed a job is still running, or None when it ran on another host."""
+    host, pid, _ = worker.rsplit(":", 2)
+    if host != socket.gethostname():
+        return None
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class JobQueue:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        # Autocommit mode, so claims can open their own BEGIN IMMEDIATE transaction
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def enqueue(self, prompt, directory, batch, metadata=None):
+        now = time.time()
+        with self.lock:
+            return self.conn.execute(
+                """INSERT INTO jobs (batch, prompt, directory, metadata, created_at, updated_at)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                (batch, prompt, os.path.abspath(directory), json.dumps(metadata) if metadata else None, now, now)
+            ).lastrowid
+
+    def claim(self, batch=None):
+        """Mark the oldest due pending job as in-flight and return it, or None."""
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(
+                    f"""SELECT * FROM jobs WHERE status = 'pending' AND not_before <= ?
+                        {'AND batch = ?' if batch else ''} ORDER BY id LIMIT 1""",
+                    (now, batch) if batch else (now,)
+                ).fetchone()
+                if row:
+                    self.conn.execute(
+                        """UPDATE jobs SET status = 'in-flight', attempts = attempts + 1, worker = ?,
+                           claimed_at = ?, updated_at = ? WHERE id = ?""",
+                        (worker_id(), now, now, row["id"])
+                    )
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        job = dict(row)
+        job["attempts"] += 1
+        job["metadata"] = json.loads(job["metadata"]) if job["metadata"] else None
+        return job
+
+    def complete(self, job_id, output, revised_prompt=None):
+        with self.lock:
+            self.conn.execute(
+                """UPDATE jobs SET status = 'done', output = ?, revised_prompt = ?, error = NULL, updated_at = ?
+                   WHERE id = ?""",
+                (output, revised_prompt, time.time(), job_id)
+            )
+
+    def fail(self, job, error):
+        """Put a failed job back with a jittered exponential backoff, or mark it failed after MAX_ATTEMPTS."""
+        now = time.time()
+        if job["attempts"] < MAX_ATTEMPTS:
+            delay = random.uniform(0.5, 1) * min(BACKOFF_CAP, BACKOFF_BASE * 2 ** (job["attempts"] - 1))
+            status, not_before = "pending", now + delay
+        else:
+            status, not_before = "failed", 0
+        with self.lock:
+            self.conn.execute(
+                "UPDATE jobs SET status = ?, not_before = ?, error = ?, updated_at = ? WHERE id = ?",
+                (status, not_before, error, now, job["id"])
+            )
+        return status
+
+    def recover(self):
+        """Return jobs abandoned in-flight by dead workers to pending. Returns how many were recovered."""
+        with self.lock:
+            rows = self.conn.execute("SELECT id, worker, claimed_at FROM jobs WHERE status = 'in-flight'").fetchall()
+        leases = {None: LEASE, True: LOCAL_LEASE}
+        stale = []
+        for row in rows:
+            alive = worker_alive(row["worker"])
+            if alive is False or row["claimed_at"] < time.time() - leases[alive]:
+                stale.append(row["id"])
+        with self.lock:
+            for job_id in stale:
+                # Unfinished attempts don't count against the job
+                self.conn.execute(
+                    """UPDATE jobs SET status = 'pending', attempts = MAX(attempts - 1, 0), updated_at = ?
+                       WHERE id = ? AND status = 'in-flight'""",
+                    (time.time(), job_id)
+                )
+        return len(stale)
+
+    def retry_failed(self, batch=None):
+        with self.lock:
+            return self.conn.execute(
+                f"""UPDATE jobs SET status = 'pending', attempts = 0, not_before = 0, updated_at = ?
+                    WHERE status = 'failed' {'AND batch = ?' if batch else ''}""",
+                (time.time(), batch) if batch else (time.time(),)
+            ).rowcount
+
+    def clear(self, batch=None):
+        """Delete done and failed jobs."""
+        with self.lock:
+            return self.conn.execute(
+                f"DELETE FROM jobs WHERE status IN ('done', 'failed') {'AND batch = ?' if batch else ''}",
+                (batch,) if batch else ()
+            ).rowcount
+
+    def counts(self, batch=None):
+        """Jobs per status, e.g. {'pending': 3, 'in-flight': 1, 'done': 16, 'failed': 0}."""
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT status, COUNT(*) FROM jobs {'WHERE batch = ?' if batch else ''} GROUP BY status",
+                (batch,) if batch else ()
+            ).fetchall()
+        counts = dict.fromkeys(STATUSES, 0)
+        counts.update({status: count for status, count in rows})
+        return counts
+
+    def next_due(self, batch=None):
+        """When the earliest pending job may be claimed, or None when nothing is pending."""
+        with self.lock:
+            return self.conn.execute(
+                f"SELECT MIN(not_before) FROM jobs WHERE status = 'pending' {'AND batch = ?' if batch else ''}",
+                (batch,) if batch else ()
+            ).fetchone()[0]
+
+    def jobs(self, batch=None, status=None, limit=None):
+        """List jobs oldest first as dicts, optionally filtered by batch and status."""
+        conditions, params = [], []
+        if batch:
+            conditions.append("batch = ?")
+            params.append(batch)
+        if status:
+            conditions.append("status = ?")
+            params.append(status)
+        query = f"SELECT * FROM jobs {'WHERE ' + ' AND '.join(conditions) if conditions else ''} ORDER BY id"
+        if limit:
+            query += f" LIMIT {int(limit)}"
+        with self.lock:
+            return [dict(row) for row in self.conn.execute(query, params).fetchall()]
+
+    def batches(self):
+        """Every batch with its job counts per status, oldest first."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT batch, status, COUNT(*) FROM jobs GROUP BY batch, status ORDER BY MIN(id)"
+            ).fetchall()
+        batches = {}
+        for batch, status, count in rows:
+            batches.setdefault(batch, dict.fromkeys(STATUSES, 0))[status] = count
+        return batches
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+def open_queue(db_path):
+    """Return the shared JobQueue for a database path."""
+    path = os.path.abspath(db_path)
+    with _queues_lock:
+        if path not in _queues:
+            _queues[path] = JobQueue(path)
+        return _queues[path]
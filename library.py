@@ -0,0 +1,431 @@
+"""
+Persistent index of the wallpaper library.
+
+Keeps one row per image (prompt, city, release tag, size, mtime and the sidecar
+JSON metadata) in an SQLite database, so rotation and fetch lookups never need to
+glob the images directory. The database lives outside the images directory so its
+journal files don't disturb the directory mtimes used for incremental syncs.
+
+Rotation draws from a persisted shuffled deck per directory, so every image is
+shown once before any repeats and each pick is a single indexed lookup.
+
+Rebuild the index from the existing image/.json pairs with:
+   python generate-wallpaper.py reindex
+"""
+
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+
+LIBRARY_FILE = "library.db"
+# Generated and fetched images are PNGs, `compact` may convert them to lossless WebP
+IMAGE_EXTENSIONS = (".png", ".webp")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    directory TEXT NOT NULL,
+    prompt TEXT,
+    description TEXT,
+    city TEXT,
+    tag TEXT,
+    size INTEGER,
+    mtime REAL,
+    metadata TEXT
+);
+CREATE INDEX IF NOT EXISTS images_directory ON images (directory, id);
+CREATE INDEX IF NOT EXISTS images_city_tag ON images (city, tag);
+CREATE TABLE IF NOT EXISTS directories (
+    directory TEXT PRIMARY KEY,
+    mtime_ns INTEGER
+);
+CREATE TABLE IF NOT EXISTS deck (
+    image_id INTEGER PRIMARY KEY,
+    directory TEXT NOT NULL,
+    position REAL NOT NULL,
+    city TEXT
+);
+CREATE INDEX IF NOT EXISTS deck_position ON deck (directory, position);
+CREATE INDEX IF NOT EXISTS deck_city ON deck (directory, city, position);
+CREATE TABLE IF NOT EXISTS releases (
+    url TEXT PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT,
+    body TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS phashes (
+    image_id INTEGER PRIMARY KEY,
+    hash INTEGER NOT NULL,
+    c0 INTEGER NOT NULL,
+    c1 INTEGER NOT NULL,
+    c2 INTEGER NOT NULL,
+    c3 INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS phashes_c0 ON phashes (c0);
+CREATE INDEX IF NOT EXISTS phashes_c1 ON phashes (c1);
+CREATE INDEX IF NOT EXISTS phashes_c2 ON phashes (c2);
+CREATE INDEX IF NOT EXISTS phashes_c3 ON phashes (c3);
+CREATE TABLE IF NOT EXISTS reuse_keys (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    image_id INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (kind, key, image_id)
+);
+CREATE TABLE IF NOT EXISTS compacted (
+    image_id INTEGER PRIMARY KEY,
+    format TEXT NOT NULL
+);
+"""
+
+# Perceptual hashes are 64 bit, looked up by their four 16 bit chunks
+PHASH_CHUNKS = 4
+PHASH_CHUNK_BITS = 16
+
+_libraries = {}
+_libraries_lock = threading.Lock()
+
+def open_library(db_path):
+    """Return the shared Library for a database path."""
+    path = os.path.abspath(db_path)
+    with _libraries_lock:
+        if path not in _libraries:
+            _libraries[path] = Library(path)
+        return _libraries[path]
+
+def read_sidecar(image_path):
+    """Load the JSON metadata written next to a generated image, if any."""
+    json_path = f"{os.path.splitext(image_path)[0]}.json"
+    try:
+        with open(json_path, 'r') as json_file:
+            return json.load(json_file)
+    except (OSError, ValueError):
+        return {}
+
+def phash_chunks(phash):
+    mask = (1 << PHASH_CHUNK_BITS) - 1
+    return [(phash >> (PHASH_CHUNK_BITS * i)) & mask for i in range(PHASH_CHUNKS)]
+
+def chunk_neighbours(chunk, radius):
+    """Every chunk value within `radius` bit flips of `chunk`."""
+    values = {chunk}
+    for _ in range(radius):
+        values |= {value ^ (1 << bit) for value in values for bit in range(PHASH_CHUNK_BITS)}
+    return values
+
+def normalise_city(city):
+    """Cities are indexed the way release asset names spell them ('Cape Town' -> 'Cape.Town')."""
+    return city.replace(" ", ".") if city else city
+
+def parse_city_filename(image_path):
+    """Split a fetched '<City.Name>_<tag>.png' filename into (city, tag)."""
+    base_name = os.path.splitext(os.path.basename(image_path))[0]
+    if "_" not in base_name:
+        return None, None
+    city, tag = base_name.rsplit("_", 1)
+    return city, tag
+
+class Library:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def add(self, image_path, metadata=None, city=None, tag=None):
+        """Insert or update a single image, reading its sidecar JSON when no metadata is given."""
+        image_path = os.path.abspath(image_path)
+        if metadata is None:
+            metadata = read_sidecar(image_path)
+        stat = os.stat(image_path)
+        city = normalise_city(city or metadata.get("city"))
+        tag = tag or metadata.get("tag")
+        with self.lock, self.conn:
+            self.conn.execute(
+                """INSERT INTO images (path, directory, prompt, description, city, tag, size, mtime, metadata)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(path) DO UPDATE SET
+                     prompt=excluded.prompt, description=excluded.description, city=excluded.city,
+                     tag=excluded.tag, size=excluded.size, mtime=excluded.mtime, metadata=excluded.metadata""",
+                (image_path, os.path.dirname(image_path), metadata.get("prompt"), metadata.get("description"),
+                 city, tag, stat.st_size, stat.st_mtime, json.dumps(metadata))
+            )
+            self._deal_into_deck(image_path)
+            # Generations can be reused by exact prompt and by weather conditions
+            for kind, key in (("prompt", metadata.get("prompt")), ("weather", metadata.get("weather_key"))):
+                if key:
+                    self.conn.execute(
+                        """INSERT OR REPLACE INTO reuse_keys (kind, key, image_id, created_at)
+                           SELECT ?, ?, id, mtime FROM images WHERE path = ?""",
+                        (kind, key, image_path)
+                    )
+
+    def remove(self, image_path):
+        with self.lock, self.conn:
+            for table in ("deck", "phashes", "reuse_keys", "compacted"):
+                self.conn.execute(
+                    f"DELETE FROM {table} WHERE image_id IN (SELECT id FROM images WHERE path = ?)", (os.path.abspath(image_path),)
+                )
+            self.conn.execute("DELETE FROM images WHERE path = ?", (os.path.abspath(image_path),))
+
+    def get(self, image_path):
+        """Return the indexed row for an image as a dict, or None."""
+        with self.lock:
+            cursor = self.conn.execute("SELECT * FROM images WHERE path = ?", (os.path.abspath(image_path),))
+            row = cursor.fetchone()
+            return dict(zip([c[0] for c in cursor.description], row)) if row else None
+
+    def find(self, city, tag):
+        """Return the path of an indexed image for a city and release tag, or None."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT path FROM images WHERE city = ? AND tag = ? LIMIT 1", (normalise_city(city), tag)
+            ).fetchone()
+        return row[0] if row else None
+
+    def images(self, directory):
+        """List every indexed image in a directory."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT path FROM images WHERE directory = ? ORDER BY id", (os.path.abspath(directory),)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def count(self, directory):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM images WHERE directory = ?", (os.path.abspath(directory),)
+            ).fetchone()[0]
+
+    def prompts(self):
+        """Every prompt in the library, oldest first."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT prompt FROM images WHERE prompt IS NOT NULL AND prompt != '' ORDER BY mtime"
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def sync(self, directory, force=False):
+        """Bring the index up to date with a directory.
+
+        The directory listing is only read when the directory's mtime has changed
+        since the last sync, so an unchanged library costs a single stat call.
+        """
+        directory = os.path.abspath(directory)
+        try:
+            mtime_ns = os.stat(directory).st_mtime_ns
+        except FileNotFoundError:
+            return
+        with self.lock:
+            row = self.conn.execute("SELECT mtime_ns FROM directories WHERE directory = ?", (directory,)).fetchone()
+        if row and row[0] == mtime_ns and not force:
+            return
+
+        on_disk = {entry.path for entry in os.scandir(directory) if entry.is_file() and entry.name.endswith(IMAGE_EXTENSIONS)}
+        indexed = set(self.images(directory))
+        for image_path in on_disk - indexed:
+            city, tag = (None, None)
+            if os.path.basename(directory) == "city":
+                city, tag = parse_city_filename(image_path)
+            self.add(image_path, city=city, tag=tag)
+        for image_path in indexed - on_disk:
+            self.remove(image_path)
+
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO directories (directory, mtime_ns) VALUES (?, ?)", (directory, mtime_ns)
+            )
+
+    def release(self, url):
+        """Return the last release response stored for `url` with its validators, or None."""
+        with self.lock:
+            row = self.conn.execute("SELECT etag, last_modified, body FROM releases WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        return {"etag": row[0], "last_modified": row[1], "body": json.loads(row[2])}
+
+    def save_release(self, url, etag, last_modified, body):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO releases (url, etag, last_modified, body) VALUES (?, ?, ?, ?)",
+                (url, etag, last_modified, json.dumps(body))
+            )
+
+    def unhashed_images(self, directory):
+        """Indexed images in a directory without a perceptual hash yet."""
+        with self.lock:
+            rows = self.conn.execute(
+                """SELECT images.path FROM images LEFT JOIN phashes ON phashes.image_id = images.id
+                   WHERE images.directory = ? AND phashes.image_id IS NULL ORDER BY images.id""",
+                (os.path.abspath(directory),)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def set_phash(self, image_path, phash):
+        # SQLite integers are signed 64 bit, the chunks carry the unsigned value
+        signed = phash - (1 << 64) if phash >= (1 << 63) else phash
+        with self.lock, self.conn:
+            self.conn.execute(
+                """INSERT OR REPLACE INTO phashes (image_id, hash, c0, c1, c2, c3)
+                   SELECT id, ?, ?, ?, ?, ? FROM images WHERE path = ?""",
+                (signed, *phash_chunks(phash), os.path.abspath(image_path))
+            )
+
+    def phash(self, image_path):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT hash FROM phashes JOIN images ON images.id = phashes.image_id WHERE images.path = ?",
+                (os.path.abspath(image_path),)
+            ).fetchone()
+        return row[0] & ((1 << 64) - 1) if row else None
+
+    def phashes(self, directory):
+        """Perceptual hashes of the hashed images in a directory by path, oldest image first."""
+        with self.lock:
+            rows = self.conn.execute(
+                """SELECT images.path, phashes.hash FROM phashes JOIN images ON images.id = phashes.image_id
+                   WHERE images.directory = ? ORDER BY images.mtime, images.id""",
+                (os.path.abspath(directory),)
+            ).fetchall()
+        return {path: signed & ((1 << 64) - 1) for path, signed in rows}
+
+    def similar_images(self, phash, threshold, directory=None):
+        """Return [(path, distance)] of images whose hash is within `threshold` bits of `phash`.
+
+        Multi-index hashing: if two hashes differ in at most `threshold` bits, one of
+        their four chunks differs in at most threshold // 4 bits, so only rows sharing
+        a nearby chunk value are fetched instead of scanning every hash.
+        """
+        radius = threshold // PHASH_CHUNKS
+        queries, params = [], []
+        for index, chunk in enumerate(phash_chunks(phash)):
+            values = chunk_neighbours(chunk, radius)
+            queries.append(f"SELECT image_id, hash FROM phashes WHERE c{index} IN ({','.join('?' * len(values))})")
+            params.extend(values)
+        with self.lock:
+            rows = self.conn.execute(
+                f"""SELECT images.path, candidates.hash FROM ({' UNION '.join(queries)}) AS candidates
+                    JOIN images ON images.id = candidates.image_id
+                    {'WHERE images.directory = ?' if directory else ''}""",
+                (*params, *([os.path.abspath(directory)] if directory else []))
+            ).fetchall()
+        matches = []
+        for path, signed in rows:
+            distance = bin((signed & ((1 << 64) - 1)) ^ phash).count("1")
+            if distance <= threshold:
+                matches.append((path, distance))
+        return sorted(matches, key=lambda match: match[1])
+
+    def uncompacted_images(self, directory, image_format):
+        """Images in a directory that haven't been compacted to `image_format` yet."""
+        with self.lock:
+            rows = self.conn.execute(
+                """SELECT images.path FROM images LEFT JOIN compacted ON compacted.image_id = images.id
+                   WHERE images.directory = ? AND (compacted.format IS NULL OR compacted.format != ?)
+                   ORDER BY images.id""",
+                (os.path.abspath(directory), image_format)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def set_compacted(self, image_path, new_path, image_format):
+        """Record a compacted image, moving its row to `new_path` when the format changed its name."""
+        image_path, new_path = os.path.abspath(image_path), os.path.abspath(new_path)
+        stat = os.stat(new_path)
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT id, metadata FROM images WHERE path = ?", (image_path,)).fetchone()
+            if row is None:
+                return
+            metadata = json.loads(row[1]) if row[1] else {}
+            if "filename" in metadata:
+                metadata["filename"] = new_path
+            self.conn.execute(
+                "UPDATE images SET path = ?, size = ?, mtime = ?, metadata = ? WHERE id = ?",
+                (new_path, stat.st_size, stat.st_mtime, json.dumps(metadata), row[0])
+            )
+            self.conn.execute("INSERT OR REPLACE INTO compacted (image_id, format) VALUES (?, ?)", (row[0], image_format))
+
+    def recall(self, kind, key, max_age):
+        """Return a random existing image stored under a reuse key and younger than `max_age` seconds."""
+        with self.lock:
+            rows = self.conn.execute(
+                """SELECT images.path FROM reuse_keys JOIN images ON images.id = reuse_keys.image_id
+                   WHERE reuse_keys.kind = ? AND reuse_keys.key = ? AND reuse_keys.created_at >= ?""",
+                (kind, key, time.time() - max_age)
+            ).fetchall()
+        candidates = [row[0] for row in rows if os.path.exists(row[0])]
+        return random.choice(candidates) if candidates else None
+
+    def reindex(self, directories):
+        """Drop the index and rebuild it from the image/.json pairs on disk."""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM images")
+            self.conn.execute("DELETE FROM directories")
+            self.conn.execute("DELETE FROM deck")
+            self.conn.execute("DELETE FROM phashes")
+            self.conn.execute("DELETE FROM reuse_keys")
+            self.conn.execute("DELETE FROM compacted")
+        for directory in directories:
+            self.sync(directory, force=True)
+        return sum(self.count(directory) for directory in directories)
+
+    def _deal_into_deck(self, image_path):
+        # A new image joins the current deck at a random position, so it shows up
+        # within this cycle without reshuffling. Without a deck it waits for the next shuffle.
+        row = self.conn.execute(
+            """SELECT images.id, images.directory, images.city, MIN(deck.position), MAX(deck.position)
+               FROM images LEFT JOIN deck ON deck.directory = images.directory
+               WHERE images.path = ?""", (image_path,)
+        ).fetchone()
+        image_id, directory, city, low, high = row
+        if low is None:
+            return
+        self.conn.execute(
+            "INSERT OR IGNORE INTO deck (image_id, directory, position, city) VALUES (?, ?, ?, ?)",
+            (image_id, directory, random.uniform(low, high), city)
+        )
+
+    def _shuffle_deck(self, directory):
+        rows = self.conn.execute("SELECT id, city FROM images WHERE directory = ?", (directory,)).fetchall()
+        random.shuffle(rows)
+        self.conn.execute("DELETE FROM deck WHERE directory = ?", (directory,))
+        self.conn.executemany(
+            "INSERT INTO deck (image_id, directory, position, city) VALUES (?, ?, ?, ?)",
+            [(image_id, directory, position, city) for position, (image_id, city) in enumerate(rows)]
+        )
+        return len(rows)
+
+    def next_image(self, directory, exclude=None, city=None, prefer_recent=False):
+        """Draw the next wallpaper from the directory's shuffled deck.
+
+        The current wallpaper is skipped and stays in the deck. With `city`, images
+        tagged with that city are drawn first; with `prefer_recent`, the newest unseen
+        image is drawn instead of the next card. The deck is reshuffled only once
+        every image has been shown, so a pick is constant work.
+        """
+        directory = os.path.abspath(directory)
+        exclude = os.path.abspath(exclude) if exclude else ""
+        order = "deck.image_id DESC" if prefer_recent else "deck.position"
+        filters = [("AND deck.city = ?", (normalise_city(city),))] if city else []
+        filters.append(("", ()))
+
+        with self.lock, self.conn:
+            for attempt in range(2):
+                for condition, params in filters:
+                    row = self.conn.execute(
+                        f"""SELECT deck.image_id, images.path FROM deck JOIN images ON images.id = deck.image_id
+                            WHERE deck.directory = ? {condition} AND images.path != ?
+                            ORDER BY {order} LIMIT 1""",
+                        (directory, *params, exclude)
+                    ).fetchone()
+                    if row:
+                        self.conn.execute("DELETE FROM deck WHERE image_id = ?", (row[0],))
+                        return row[1]
+                if not self._shuffle_deck(directory):
+                    return None
+        # Only the excluded wallpaper is left in the library
+        return exclude or None
@@ -0,0 +1,183 @@
+"""
+Batched wallpaper prompt generation.
+
+Prompts are requested from GPT-4o as structured JSON (`{"prompts": [...]}`), so
+numbering, preambles and blank lines never reach DALL-E. Replies are streamed
+and every prompt is handed on as soon as its array element is complete, so the
+first image starts after one prompt has been written. Large counts are split
+into chunks that are requested in parallel, which keeps each completion short.
+Prompts are deduplicated across chunks and against the prompts already in the
+library; chunks are re-requested until exactly `count` unique prompts arrived.
+"""
+
+import json
+import queue
+import re
+
+import telemetry
+
+MODEL = "gpt-4o"
+CHUNK_SIZE = 5
+MAX_ROUNDS = 3
+# Recent prompts shown to the model so it steers away from them
+AVOID_LIMIT = 20
+MIN_WORDS = 4
+
+RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "wallpaper_prompts",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {"prompts": {"type": "array", "items": {"type": "string"}}},
+            "required": ["prompts"],
+            "additionalProperties": False
+        }
+    }
+}
+
+def prompt_messages(count, prompt, avoid=(), batch=None):
+    messages = [
+        {"role": "system", "content": "You are a creative assistant specialized in generating unique, special, random, and mesmerizing prompts for wallpaper creation using DALL-E 3."},
+        {"role": "system", "content": "Each prompt should be a standalone idea for a wallpaper. Reply with a JSON object whose \"prompts\" array holds exactly the requested number of prompts and nothing else."},
+        {"role": "system", "content": "Generate %s prompts for me. Ensure each prompt is unique, captivating, and suitable for creating stunning wallpapers." % (count)},
+        {"role": "system", "content": "Consider various themes such as nature, abstract art, futuristic landscapes, and surreal scenes. Make sure the prompts are diverse and imaginative."}
+    ]
+    if batch:
+        messages.append({"role": "system", "content": "This is batch %s of %s requested at the same time, pick themes the other batches are unlikely to choose." % batch})
+    if avoid:
+        messages.append({"role": "system", "content": "These prompts were already used, do not repeat them or close variations:\n" + "\n".join(avoid)})
+    messages.append({"role": "user", "content": prompt})
+    return messages
+
+def normalise_prompt(prompt):
+    """Key used to spot repeats: case, whitespace and trailing punctuation are ignored."""
+    return " ".join(prompt.split()).casefold().rstrip(".!")
+
+def clean_prompt(text):
+    """Strip list markers and quotes. Returns None for text that isn't a usable prompt."""
+    if not isinstance(text, str):
+        return None
+    text = re.sub(r"^\s*(?:[-*•]|\d+[.):]|prompt\s*\d*\s*:)\s*", "", text, flags=re.IGNORECASE)
+    text = text.strip().strip("\"'“”").strip()
+    if len(text.split()) < MIN_WORDS or text.endswith(":"):
+        return None
+    return text
+
+def parse_prompts(content):
+    """Read the prompts from a JSON reply, falling back to one prompt per line."""
+    try:
+        prompts = json.loads(content)["prompts"]
+    except (ValueError, TypeError, KeyError):
+        prompts = (content or "").splitlines()
+    return [prompt for prompt in map(clean_prompt, prompts) if prompt]
+
+class PromptArrayParser:
+    """Pull the complete strings out of a `{"prompts": [...]}` reply while it is still arriving."""
+
+    def __init__(self):
+        self.content = ""
+        self.position = None
+        self.decoder = json.JSONDecoder()
+
+    def feed(self, text):
+        """Add streamed text and return the array elements completed by it."""
+        self.content += text
+        if self.position is None:
+            start = self.content.find("[")
+            if start < 0:
+                return []
+            self.position = start + 1
+        elements = []
+        while True:
+            index = self.position
+            while index < len(self.content) and self.content[index] in " \t\r\n,":
+                index += 1
+            if index >= len(self.content) or self.content[index] == "]":
+                break
+            try:
+                element, self.position = self.decoder.raw_decode(self.content, index)
+            except ValueError:
+                # The element is still being written
+                break
+            elements.append(element)
+        return elements
+
+def request_prompts(client, count, prompt, avoid=(), batch=None):
+    """Yield the prompts of one streamed completion, each as soon as it is complete."""
+    parser = PromptArrayParser()
+    usage = None
+    streamed = False
+    with telemetry.span("prompts"):
+        response = client.chat.completions.create(
+            model=MODEL,
+            messages=prompt_messages(count, prompt, avoid, batch),
+            response_format=RESPONSE_FORMAT,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        for chunk in response:
+            usage = chunk.usage or usage
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            for element in parser.feed(chunk.choices[0].delta.content):
+                cleaned = clean_prompt(element)
+                if cleaned:
+                    streamed = True
+                    yield cleaned
+        if not streamed:
+            # Not the JSON that was asked for, read it as one prompt per line
+            yield from parse_prompts(parser.content)
+    telemetry.count("api_calls", api="chat")
+    telemetry.count("cost_usd", telemetry.token_cost(MODEL, usage), api="chat")
+
+def chunk_counts(count, chunk_size):
+    return [min(chunk_size, count - start) for start in range(0, count, chunk_size)]
+
+def batched_prompts(client, count, prompt, history=(), chunk_size=CHUNK_SIZE, concurrency=4):
+    """Yield `count` unique prompts, each as soon as it has been streamed in.
+
+    `history` holds previously used prompts. Gives up after MAX_ROUNDS rounds of
+    re-requests, so fewer than `count` prompts are yielded only when the model keeps
+    repeating itself.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    history = list(history)
+    seen = {normalise_prompt(p) for p in history}
+    avoid = history[-AVOID_LIMIT:]
+    remaining = count
+    # Chunk threads put their prompts here as they stream in, then None when they finish
+    arrivals = queue.Queue()
+
+    def request_chunk(n, batch):
+        try:
+            for candidate in request_prompts(client, n, prompt, avoid, batch):
+                arrivals.put(candidate)
+        except Exception as e:
+            print(f"Failed to generate prompts: {str(e)}")
+        finally:
+            arrivals.put(None)
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        for _ in range(MAX_ROUNDS):
+            if remaining <= 0:
+                return
+            counts = chunk_counts(remaining, chunk_size)
+            for i, n in enumerate(counts):
+                executor.submit(request_chunk, n, (i + 1, len(counts)) if len(counts) > 1 else None)
+            running = len(counts)
+            while running:
+                candidate = arrivals.get()
+                if candidate is None:
+                    running -= 1
+                    continue
+                key = normalise_prompt(candidate)
+                if remaining <= 0 or key in seen:
+                    continue
+                seen.add(key)
+                remaining -= 1
+                yield candidate
+        if remaining > 0:
+            print(f"Only got {count - remaining} of {count} unique prompts.")
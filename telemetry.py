@@ -0,0 +1,247 @@
+"""
+Per-stage timings and usage counters.
+
+Code under measurement wraps each stage in `span(name)` and reports usage with
+`count(name, value, **labels)`. Events are buffered in memory and written by
+`flush()` (at exit, and after every daemon job) to:
+
+  - a JSONL log, one line per span and one line of counters per flush, which the
+    `stats` command summarises into p50/p95 latency per stage;
+  - a Prometheus textfile (for node_exporter's textfile collector) with running
+    totals: stage seconds sum/count, API calls, downloaded bytes, cache hits and
+    misses and the estimated API cost in USD.
+
+Both paths can be set in config.ini:
+   [Telemetry]
+   log = /path/to/telemetry.jsonl
+   textfile = /path/to/wallpaper_generator.prom
+   enabled = true
+"""
+
+import atexit
+import configparser
+import contextlib
+import fcntl
+import json
+import math
+import os
+import re
+import threading
+import time
+
+LOG_FILE = "telemetry.jsonl"
+TEXTFILE = "wallpaper_generator.prom"
+# The log is rotated to <log>.1 once it grows past this size
+MAX_LOG_BYTES = 10 * 1024 * 1024
+METRIC_PREFIX = "wallpaper_generator_"
+
+# Estimated USD prices: per image, or per million input and output tokens
+IMAGE_PRICES = {("dall-e-3", "hd", "1792x1024"): 0.12, ("dall-e-3", "standard", "1792x1024"): 0.08}
+TOKEN_PRICES = {"gpt-4o": (2.5, 10.0), "gpt-4": (30.0, 60.0)}
+
+SAMPLE_LINE = re.compile(r"^(\w+)(\{.*\})? (\S+)$")
+
+def counter_key(name, labels):
+    """'api_calls', {'api': 'images'} -> 'api_calls{api="images"}', the Prometheus sample name."""
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{label}="{value}"' for label, value in sorted(labels.items())) + "}"
+
+def image_cost(model, quality, size):
+    return IMAGE_PRICES.get((model, quality, size), 0.0)
+
+def token_cost(model, usage):
+    """Cost of a chat completion from its `usage`, or 0 when usage or the model's price is unknown."""
+    prices = TOKEN_PRICES.get(model)
+    if not prices or usage is None:
+        return 0.0
+    return (usage.prompt_tokens * prices[0] + usage.completion_tokens * prices[1]) / 1_000_000
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+class Recorder:
+    def __init__(self, log_path, textfile_path, enabled=True):
+        self.log_path = log_path
+        self.textfile_path = textfile_path
+        self.enabled = enabled
+        self.command = None
+        self.runs = 0
+        self.run = self.next_run()
+        self.lock = threading.Lock()
+        self.spans = []
+        self.counters = {}
+        self.stage_totals = {}
+
+    def next_run(self):
+        self.runs += 1
+        return f"{os.getpid()}-{int(time.time())}-{self.runs}"
+
+    @contextlib.contextmanager
+    def span(self, stage):
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            with self.lock:
+                self.spans.append({
+                    "type": "span", "time": time.time(), "run": self.run, "command": self.command,
+                    "stage": stage, "seconds": round(seconds, 6), "error": error
+                })
+                total = self.stage_totals.setdefault(stage, [0.0, 0])
+                total[0] += seconds
+                total[1] += 1
+
+    def count(self, name, value=1, **labels):
+        key = counter_key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def flush(self):
+        """Write buffered spans and counters to the log and fold them into the textfile totals."""
+        with self.lock:
+            spans, self.spans = self.spans, []
+            counters, self.counters = self.counters, {}
+            stage_totals, self.stage_totals = self.stage_totals, {}
+            # In the daemon every flush ends one job, the next job is a new run
+            run, self.run = self.run, self.next_run()
+        if not self.enabled or not (spans or counters):
+            return
+        lines = [json.dumps(span) for span in spans]
+        if counters:
+            lines.append(json.dumps({"type": "counters", "time": time.time(), "run": run, "command": self.command, "counters": counters}))
+        try:
+            if os.path.exists(self.log_path) and os.path.getsize(self.log_path) > MAX_LOG_BYTES:
+                os.replace(self.log_path, f"{self.log_path}.1")
+            with open(self.log_path, "a") as log:
+                # The lock keeps concurrent processes (daemon, launchd jobs) from losing textfile updates
+                fcntl.flock(log, fcntl.LOCK_EX)
+                log.write("\n".join(lines) + "\n")
+                log.flush()
+                self.update_textfile(counters, stage_totals)
+        except OSError as e:
+            print(f"Failed to write telemetry: {str(e)}")
+
+    def update_textfile(self, counters, stage_totals):
+        samples = read_textfile(self.textfile_path)
+        for key, value in counters.items():
+            name, _, labels = key.partition("{")
+            sample = f"{METRIC_PREFIX}{name}_total" + (f"{{{labels}" if labels else "")
+            samples[sample] = samples.get(sample, 0) + value
+        for stage, (seconds, calls) in stage_totals.items():
+            for suffix, value in (("sum", seconds), ("count", calls)):
+                sample = f'{METRIC_PREFIX}stage_seconds_{suffix}{{stage="{stage}"}}'
+                samples[sample] = samples.get(sample, 0) + value
+        samples[f"{METRIC_PREFIX}last_flush_timestamp_seconds"] = time.time()
+
+        lines = []
+        typed = set()
+        for sample in sorted(samples):
+            metric = sample.split("{")[0]
+            family = metric.rsplit("_", 1)[0] if metric.endswith(("_sum", "_count")) else metric
+            if family not in typed:
+                typed.add(family)
+                kind = "summary" if family != metric else "gauge" if metric.endswith("_seconds") else "counter"
+                lines.append(f"# TYPE {family} {kind}")
+            lines.append(f"{sample} {samples[sample]:.12g}")
+        partial_path = f"{self.textfile_path}.part"
+        with open(partial_path, "w") as textfile:
+            textfile.write("\n".join(lines) + "\n")
+        os.replace(partial_path, self.textfile_path)
+
+def read_textfile(path):
+    samples = {}
+    try:
+        with open(path) as textfile:
+            for line in textfile:
+                match = SAMPLE_LINE.match(line.strip())
+                if match:
+                    samples[match.group(1) + (match.group(2) or "")] = float(match.group(3))
+    except OSError:
+        pass
+    return samples
+
+def read_log(path, since=None):
+    """Yield the logged events, oldest first, optionally only those after the Unix time `since`."""
+    for log_path in (f"{path}.1", path):
+        try:
+            with open(log_path) as log:
+                for line in log:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        continue
+                    if since is None or event.get("time", 0) >= since:
+                        yield event
+        except OSError:
+            continue
+
+def summarise(events, runs=None):
+    """Per-stage latency percentiles and counter totals over the last `runs` runs.
+
+    Returns ({stage: {"count", "errors", "p50", "p95", "max"}}, {counter: total}).
+    """
+    events = list(events)
+    if runs:
+        recent = []
+        for event in reversed(events):
+            if event["run"] not in recent:
+                recent.append(event["run"])
+            if len(recent) == runs:
+                break
+        events = [event for event in events if event["run"] in recent]
+
+    durations, errors, counters = {}, {}, {}
+    for event in events:
+        if event["type"] == "span":
+            durations.setdefault(event["stage"], []).append(event["seconds"])
+            errors[event["stage"]] = errors.get(event["stage"], 0) + bool(event.get("error"))
+        elif event["type"] == "counters":
+            for key, value in event["counters"].items():
+                counters[key] = counters.get(key, 0) + value
+    stages = {
+        stage: {
+            "count": len(values),
+            "errors": errors[stage],
+            "p50": percentile(values, 0.5),
+            "p95": percentile(values, 0.95),
+            "max": max(values)
+        }
+        for stage, values in durations.items()
+    }
+    return stages, counters
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+def recorder():
+    """The process-wide Recorder, configured from config.ini and flushed at exit."""
+    global _recorder
+    with _recorder_lock:
+        if _recorder is None:
+            directory = os.path.dirname(os.path.abspath(__file__))
+            config = configparser.ConfigParser()
+            config.read(os.path.join(directory, 'config.ini'))
+            _recorder = Recorder(
+                config.get('Telemetry', 'log', fallback=os.path.join(directory, LOG_FILE)),
+                config.get('Telemetry', 'textfile', fallback=os.path.join(directory, TEXTFILE)),
+                config.getboolean('Telemetry', 'enabled', fallback=True)
+            )
+            atexit.register(_recorder.flush)
+        return _recorder
+
+def span(stage):
+    return recorder().span(stage)
+
+def count(name, value=1, **labels):
+    recorder().count(name, value, **labels)
+
+def flush():
+    recorder().flush()
@@ -0,0 +1,32 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+import telemetry
+
+@pytest.fixture(autouse=True)
+def no_telemetry():
+    # Tests never write to the real telemetry log
+    telemetry.recorder().enabled = False
+
+@pytest.fixture(scope="session")
+def stub():
+    from stubs import StubServer
+
+    server = StubServer(image_size=(64, 32))
+    yield server
+    server.close()
+
+@pytest.fixture
+def http(stub):
+    """A Transport whose Open-Meteo and GitHub requests go to the stub server."""
+    import transport
+    from stubs import redirect
+
+    session_transport = transport.Transport(retries=0)
+    redirect(session_transport.session, stub.base_url)
+    return session_transport
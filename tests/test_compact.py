@@ -0,0 +1,102 @@
+import io
+import json
+import os
+import struct
+import zlib
+
+from PIL import Image
+
+import compact
+import library
+import pngtext
+
+TEXTS = {"Image Prompt": "A harbour at dawn", "Revised Prompt": "Un port à l'aube"}
+
+def write_wallpaper(directory, name, image, mtime=1_000_000_000):
+    """A generated wallpaper: a PNG at low compression with prompt text chunks, and its sidecar JSON."""
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG", compress_level=1)
+    path = os.path.join(directory, f"{name}.png")
+    pngtext.save_png_with_text([buffer.getvalue()], path, TEXTS)
+    os.utime(path, (mtime, mtime))
+    with open(os.path.join(directory, f"{name}.json"), "w") as json_file:
+        json.dump({"prompt": TEXTS["Image Prompt"], "filename": path}, json_file)
+    return path
+
+def gradient():
+    return Image.linear_gradient("L").resize((384, 256)).convert("RGB")
+
+def open_library(tmp_path):
+    return library.Library(str(tmp_path / library.LIBRARY_FILE))
+
+def test_webp_conversion_keeps_pixels_metadata_and_links(tmp_path):
+    images = tmp_path / "images"
+    images.mkdir()
+    path = write_wallpaper(str(images), "harbour", gradient())
+    wallpaper_library = open_library(tmp_path)
+    wallpaper_library.sync(str(images))
+
+    stats = compact.compact_library(wallpaper_library, wallpaper_library.uncompacted_images(str(images), "webp"), "webp")
+
+    webp_path = str(images / "harbour.webp")
+    assert stats["renamed"] == {path: webp_path}
+    assert stats["bytes_after"] < stats["bytes_before"]
+    assert not os.path.exists(path)
+    with Image.open(webp_path) as image:
+        assert image.tobytes() == gradient().tobytes()
+        assert b'wallpaper:ImagePrompt="A harbour at dawn"' in image.info["xmp"]
+    assert os.stat(webp_path).st_mtime == 1_000_000_000
+    with open(images / "harbour.json") as json_file:
+        assert json.load(json_file)["filename"] == webp_path
+    assert wallpaper_library.images(str(images)) == [webp_path]
+    assert wallpaper_library.get(webp_path)["prompt"] == TEXTS["Image Prompt"]
+    # Incremental: nothing is left to convert
+    assert wallpaper_library.uncompacted_images(str(images), "webp") == []
+
+def test_png_recompression_keeps_text_in_place(tmp_path):
+    path = write_wallpaper(str(tmp_path), "harbour", gradient())
+    old_path, new_path, before, after = compact.compact_image(path, "png")
+    assert new_path == old_path == path
+    assert after < before
+    with Image.open(path) as image:
+        assert image.text == TEXTS
+        assert image.tobytes() == gradient().tobytes()
+
+def test_sixteen_bit_colour_is_left_alone(tmp_path):
+    def chunk(chunk_type, data):
+        return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+    rows = b"".join(b"\0" + bytes(range(8 * 6)) for _ in range(4))
+    data = (pngtext.PNG_SIGNATURE + chunk(b"IHDR", struct.pack(">IIBBBBB", 8, 4, 16, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(rows, 0)) + chunk(b"IEND", b""))
+    path = str(tmp_path / "deep.png")
+    with open(path, "wb") as f:
+        f.write(data)
+
+    for image_format in compact.FORMATS:
+        assert compact.compact_image(path, image_format) is None
+    with open(path, "rb") as f:
+        assert f.read() == data
+
+def chunk_types(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    types, offset = [], len(pngtext.PNG_SIGNATURE)
+    while offset < len(data):
+        length, chunk_type = struct.unpack(">I4s", data[offset:offset + 8])
+        types.append(chunk_type)
+        offset += length + 12
+    return types
+
+def test_png_recompression_keeps_a_single_icc_profile(tmp_path):
+    from PIL import ImageCms
+
+    profile = ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB")).tobytes()
+    path = str(tmp_path / "tagged.png")
+    gradient().save(path, "PNG", compress_level=1, icc_profile=profile)
+
+    assert compact.compact_image(path, "png")[0] == path
+    assert chunk_types(path).count(b"iCCP") == 1
+    with Image.open(path) as image:
+        assert image.info["icc_profile"] == profile
+        assert image.tobytes() == gradient().tobytes()
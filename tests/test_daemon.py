@@ -0,0 +1,37 @@
+import os
+import threading
+import time
+
+import daemon
+
+def start(socket_path):
+    scheduler = daemon.Daemon(socket_path)
+    scheduler.add_job("rotate", lambda: "rotated")
+    results = []
+    thread = threading.Thread(target=lambda: results.append(scheduler.serve_forever()))
+    thread.start()
+    for _ in range(50):
+        if daemon.send_command("status", socket_path):
+            break
+        time.sleep(0.05)
+    return thread, results
+
+def test_second_daemon_exits_while_the_first_keeps_running(tmp_path):
+    socket_path = str(tmp_path / "daemon.sock")
+    thread, results = start(socket_path)
+
+    assert daemon.Daemon(socket_path).serve_forever() is False
+    assert daemon.send_command("rotate", socket_path) == "ok rotate started"
+
+    assert daemon.send_command("stop", socket_path) == "ok stopping"
+    thread.join(5)
+    assert results == [True]
+    assert not os.path.exists(socket_path)
+
+def test_stale_socket_is_replaced(tmp_path):
+    socket_path = str(tmp_path / "daemon.sock")
+    open(socket_path, "w").close()
+    thread, results = start(socket_path)
+    assert daemon.send_command("stop", socket_path) == "ok stopping"
+    thread.join(5)
+    assert results == [True]
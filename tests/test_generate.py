@@ -0,0 +1,63 @@
+import threading
+import time
+
+from suite import load_script, openai_client
+
+PROMPTS = [f"A lighthouse on a basalt cliff, storm study {i}" for i in range(6)]
+
+class SlowFirstImages:
+    """Wraps an OpenAI client so earlier prompts take longer, finishing the batch out of order."""
+
+    def __init__(self, client, prompts, delay=0.05):
+        self.client = client
+        self.delays = {prompt: (len(prompts) - i) * delay for i, prompt in enumerate(prompts)}
+        self.images = self
+
+    def generate(self, prompt, **kwargs):
+        time.sleep(self.delays.get(prompt, 0))
+        return self.client.images.generate(prompt=prompt, **kwargs)
+
+def test_concurrent_generation_keeps_prompt_order(tmp_path, stub):
+    script = load_script(str(tmp_path))
+    images = tmp_path / "images"
+    images.mkdir()
+    client = SlowFirstImages(openai_client(stub.openai_base_url), PROMPTS)
+    generated_images = []
+
+    script.generate_images_from_prompts(client, PROMPTS, str(images), generated_images, concurrency=4)
+
+    assert len(set(generated_images)) == len(PROMPTS)
+    assert [script.get_library().get(path)["prompt"] for path in generated_images] == PROMPTS
+
+def test_rate_limiter_spaces_calls_across_threads(tmp_path):
+    limiter = load_script(str(tmp_path)).RateLimiter(per_minute=1200)
+    starts = []
+    lock = threading.Lock()
+
+    def call():
+        limiter.wait()
+        with lock:
+            starts.append(time.monotonic())
+
+    threads = [threading.Thread(target=call) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    starts.sort()
+    # 1200 per minute is one call every 50 ms, with some slack for thread scheduling
+    assert all(later - earlier >= 0.03 for earlier, later in zip(starts, starts[1:]))
+    assert 0.19 <= starts[-1] - starts[0] < 0.5
+
+def test_repeated_prompts_get_their_own_files(tmp_path, stub):
+    script = load_script(str(tmp_path))
+    images = tmp_path / "images"
+    images.mkdir()
+    prompts = [PROMPTS[0]] * 4
+    generated_images = []
+
+    script.generate_images_from_prompts(openai_client(stub.openai_base_url), prompts, str(images), generated_images, concurrency=4)
+
+    assert len(set(generated_images)) == 4
+    assert len(list(images.glob("*.png"))) == len(list(images.glob("*.json"))) == 4
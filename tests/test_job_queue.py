@@ -0,0 +1,98 @@
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import job_queue
+
+def open_queue(tmp_path):
+    return job_queue.JobQueue(str(tmp_path / job_queue.QUEUE_FILE))
+
+def test_jobs_are_claimed_oldest_first_and_completed(tmp_path):
+    queue = open_queue(tmp_path)
+    batch = job_queue.new_batch()
+    first = queue.enqueue("first prompt", str(tmp_path), batch, {"city": "London"})
+    queue.enqueue("second prompt", str(tmp_path), batch)
+
+    job = queue.claim(batch)
+    assert (job["id"], job["status"], job["attempts"], job["metadata"]) == (first, "pending", 1, {"city": "London"})
+    queue.complete(job["id"], "/images/first.png", "A revised prompt")
+    assert queue.counts(batch) == {"pending": 1, "in-flight": 0, "done": 1, "failed": 0}
+
+def test_concurrent_claims_never_share_a_job(tmp_path):
+    queue = open_queue(tmp_path)
+    for i in range(50):
+        queue.enqueue(f"prompt {i}", str(tmp_path), "batch")
+    claimed = []
+
+    def worker():
+        while True:
+            job = queue.claim()
+            if job is None:
+                return
+            claimed.append(job["id"])
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed) == sorted(set(claimed))
+    assert len(claimed) == 50
+
+def test_failed_jobs_back_off_then_fail(tmp_path):
+    queue = open_queue(tmp_path)
+    queue.enqueue("flaky prompt", str(tmp_path), "batch")
+    for attempt in range(1, job_queue.MAX_ATTEMPTS + 1):
+        with queue.conn:
+            queue.conn.execute("UPDATE jobs SET not_before = 0")
+        job = queue.claim()
+        assert job["attempts"] == attempt
+        status = queue.fail(job, "boom")
+    assert status == "failed"
+    assert queue.claim() is None
+    assert queue.retry_failed() == 1
+    assert queue.claim()["attempts"] == 1
+
+def test_recover_returns_jobs_of_dead_workers(tmp_path):
+    queue = open_queue(tmp_path)
+    queue.enqueue("abandoned prompt", str(tmp_path), "batch")
+    queue.enqueue("running prompt", str(tmp_path), "batch")
+    abandoned, running = queue.claim(), queue.claim()
+
+    finished = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"], capture_output=True, text=True)
+    dead_worker = f"{socket.gethostname()}:{int(finished.stdout)}:1"
+    with queue.conn:
+        queue.conn.execute("UPDATE jobs SET worker = ? WHERE id = ?", (dead_worker, abandoned["id"]))
+
+    assert queue.recover() == 1
+    jobs = {job["id"]: job for job in queue.jobs()}
+    assert (jobs[abandoned["id"]]["status"], jobs[abandoned["id"]]["attempts"]) == ("pending", 0)
+    assert jobs[running["id"]]["status"] == "in-flight"
+
+def test_lease_only_expires_jobs_claimed_on_other_hosts(tmp_path):
+    queue = open_queue(tmp_path)
+    for prompt in ("slow local prompt", "remote prompt"):
+        queue.enqueue(prompt, str(tmp_path), "batch")
+    local, remote = queue.claim(), queue.claim()
+    expired = time.time() - job_queue.LEASE - 1
+    with queue.conn:
+        queue.conn.execute("UPDATE jobs SET claimed_at = ?", (expired,))
+        queue.conn.execute("UPDATE jobs SET worker = ? WHERE id = ?", ("elsewhere.example:1234:1", remote["id"]))
+
+    assert queue.recover() == 1
+    jobs = {job["id"]: job for job in queue.jobs()}
+    assert jobs[local["id"]]["status"] == "in-flight"
+    assert jobs[remote["id"]]["status"] == "pending"
+
+def test_local_lease_expires_jobs_of_reused_process_ids(tmp_path):
+    queue = open_queue(tmp_path)
+    queue.enqueue("orphaned prompt", str(tmp_path), "batch")
+    # The claiming process is this one, as if its id had been reused after a crash
+    queue.claim()
+    with queue.conn:
+        queue.conn.execute("UPDATE jobs SET claimed_at = ?", (time.time() - job_queue.LOCAL_LEASE - 1,))
+
+    assert queue.recover() == 1
+    assert queue.jobs()[0]["status"] == "pending"
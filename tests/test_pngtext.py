@@ -0,0 +1,42 @@
+import io
+
+import pytest
+from PIL import Image
+
+import pngtext
+from stubs import make_png
+
+def test_spliced_text_is_read_back_and_pixels_are_unchanged(tmp_path):
+    data = make_png(48, 32, seed=1)
+    path = str(tmp_path / "wallpaper.png")
+    # Small chunks, so the IHDR header is split across several of them
+    chunks = [data[i:i + 7] for i in range(0, len(data), 7)]
+    pngtext.save_png_with_text(chunks, path, {"Image Prompt": "A harbour at dawn", "Revised Prompt": "Un port à l'aube ✨"})
+
+    with Image.open(path) as image:
+        assert image.text == {"Image Prompt": "A harbour at dawn", "Revised Prompt": "Un port à l'aube ✨"}
+        with Image.open(io.BytesIO(data)) as original:
+            assert image.tobytes() == original.tobytes()
+    assert not (tmp_path / "wallpaper.png.part").exists()
+
+def test_non_png_data_is_converted(tmp_path):
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8), "teal").save(buffer, "JPEG")
+    path = str(tmp_path / "wallpaper.png")
+    pngtext.save_png_with_text([buffer.getvalue()], path, {"Image Prompt": "Teal"})
+
+    with Image.open(path) as image:
+        assert image.format == "PNG"
+        assert image.text == {"Image Prompt": "Teal"}
+
+def test_interrupted_download_leaves_no_partial_file(tmp_path):
+    data = make_png(48, 32, seed=2)
+
+    def broken_download():
+        yield data[:100]
+        raise ConnectionError("connection reset")
+
+    path = tmp_path / "wallpaper.png"
+    with pytest.raises(ConnectionError):
+        pngtext.save_png_with_text(broken_download(), str(path), {"Image Prompt": "Cut short"})
+    assert list(tmp_path.iterdir()) == []
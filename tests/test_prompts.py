@@ -0,0 +1,36 @@
+import prompts
+from suite import openai_client
+
+def test_parse_prompts_reads_json_and_cleans_entries():
+    content = '{"prompts": ["1. A glowing forest of crystal trees", "\\"A quiet harbour at dawn\\"", "Too short", "Prompt 3: Floating lanterns over a dark lake"]}'
+    assert prompts.parse_prompts(content) == [
+        "A glowing forest of crystal trees",
+        "A quiet harbour at dawn",
+        "Floating lanterns over a dark lake"
+    ]
+
+def test_parse_prompts_falls_back_to_lines():
+    content = "Here are your prompts:\n\n- A neon city under soft rain\n- Mountains folded like paper cranes"
+    assert prompts.parse_prompts(content) == ["A neon city under soft rain", "Mountains folded like paper cranes"]
+
+def test_prompt_array_parser_yields_elements_as_they_complete():
+    parser = prompts.PromptArrayParser()
+    assert parser.feed('{"prom') == []
+    assert parser.feed('pts": ["A city of') == []
+    assert parser.feed(' glass", "Waves of \\"light') == ["A city of glass"]
+    assert parser.feed('\\" at night"]}') == ['Waves of "light" at night']
+
+def test_normalise_prompt_ignores_case_spacing_and_punctuation():
+    assert prompts.normalise_prompt("  A Quiet   harbour at dawn. ") == prompts.normalise_prompt("a quiet harbour at dawn")
+
+def test_batched_prompts_returns_exactly_count_unique_prompts(stub):
+    client = openai_client(stub.openai_base_url)
+    generated = list(prompts.batched_prompts(client, 12, "Calm landscapes", chunk_size=5, concurrency=3))
+    assert len(generated) == 12
+    assert len({prompts.normalise_prompt(p) for p in generated}) == 12
+
+def test_batched_prompts_drops_prompts_already_used(stub):
+    client = openai_client(stub.openai_base_url)
+    first = list(prompts.batched_prompts(client, 3, "Calm landscapes"))
+    again = list(prompts.batched_prompts(client, 3, "Calm landscapes", history=first))
+    assert not {prompts.normalise_prompt(p) for p in first} & {prompts.normalise_prompt(p) for p in again}
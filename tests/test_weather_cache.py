@@ -0,0 +1,35 @@
+import weather_cache
+import weather_data
+
+def requests_made(stub):
+    return stub.requests.get("geocode", 0), stub.requests.get("forecast", 0)
+
+def test_fetch_weather_hits_misses_and_expires(tmp_path, stub, http):
+    cache = weather_cache.WeatherCache(str(tmp_path / weather_cache.CACHE_FILE), ttl=900)
+    geocodes, forecasts = requests_made(stub)
+
+    # Miss: both the city and its weather come from the API
+    first = weather_data.fetch_weather("Cache Town", session=http, cache=cache)
+    assert first["weathercode"] == 61
+    assert requests_made(stub) == (geocodes + 1, forecasts + 1)
+
+    # Hit: nothing is requested again
+    second = weather_data.fetch_weather("  cache   TOWN ", session=http, cache=cache)
+    assert second == first
+    assert requests_made(stub) == (geocodes + 1, forecasts + 1)
+
+    # Expired: the weather is fetched again, the geocoding result never expires
+    with cache.conn:
+        cache.conn.execute("UPDATE entries SET stored_at = stored_at - ?", (cache.ttl + 1,))
+    weather_data.fetch_weather("Cache Town", session=http, cache=cache)
+    assert requests_made(stub) == (geocodes + 1, forecasts + 2)
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = weather_cache.WeatherCache(str(tmp_path / weather_cache.CACHE_FILE), max_entries=2)
+    cache.put("forecast", "a", 1)
+    cache.put("forecast", "b", 2)
+    assert cache.get("forecast", "a") == 1
+    cache.put("forecast", "c", 3)
+    assert cache.get("forecast", "b") is None
+    assert cache.get("forecast", "a") == 1
+    assert cache.get("forecast", "c") == 3
@@ -0,0 +1,156 @@
+"""
+Shared HTTP transport for the weather, image and release downloads.
+
+Every request goes through a pooled keep-alive requests.Session with connect and
+read timeouts, and is retried with jittered exponential backoff on connection
+errors, 429 and 5xx responses (honouring Retry-After). Every attempt is counted
+in telemetry per host, with its outcome and latency, so `stats` and the
+Prometheus textfile show request counts, failures and mean latency per host.
+Hosts rather than paths, since image and asset URLs are unique per file.
+
+Files are downloaded in chunks to a .part file that is resumed with an HTTP
+Range request after an interruption, verified against the expected size (and
+sha256 digest, when known) and only then renamed into place.
+"""
+
+import hashlib
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import telemetry
+
+# (connect, read) timeouts in seconds
+DEFAULT_TIMEOUT = (5, 30)
+DEFAULT_RETRIES = 4
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30
+POOL_SIZE = 32
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+class DownloadError(Exception):
+    pass
+
+def host_of(url):
+    return urlsplit(url).netloc
+
+class Transport:
+    def __init__(self, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES, pool_size=POOL_SIZE):
+        self.timeout = timeout
+        self.retries = retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def record(self, url, elapsed, failed=False):
+        host = host_of(url)
+        telemetry.count("http_requests", host=host, outcome="error" if failed else "ok")
+        telemetry.count("http_seconds", elapsed, host=host)
+
+    def backoff(self, attempt, response=None):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            delay = int(retry_after)
+        else:
+            # Full jitter keeps parallel workers from retrying in lockstep
+            delay = random.uniform(0, BACKOFF_BASE * (2 ** attempt))
+        time.sleep(min(delay, BACKOFF_CAP))
+
+    def request(self, method, url, **kwargs):
+        """Send a request, retrying transient failures. Raises requests exceptions like requests does."""
+        kwargs.setdefault("timeout", self.timeout)
+        for attempt in range(self.retries + 1):
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                self.record(url, time.perf_counter() - start, failed=True)
+                if attempt == self.retries:
+                    raise
+                self.backoff(attempt)
+                continue
+
+            retryable = response.status_code in RETRY_STATUSES
+            self.record(url, time.perf_counter() - start, failed=retryable)
+            if not retryable or attempt == self.retries:
+                return response
+            response.close()
+            self.backoff(attempt, response)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def _resume(self, url, partial_path, expected_size):
+        offset = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+        if expected_size is not None and offset >= expected_size:
+            return
+
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        with self.get(url, headers=headers, stream=True) as response:
+            if response.status_code == 416:
+                # The partial file can't be resumed, start over
+                os.remove(partial_path)
+                return self._resume(url, partial_path, expected_size)
+            response.raise_for_status()
+            if response.status_code != 206:
+                offset = 0
+            with open(partial_path, "ab" if offset else "wb") as f:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+
+    def download(self, url, path, expected_size=None, expected_digest=None):
+        """Stream `url` to `path`, resuming a previous partial download if one exists.
+
+        `expected_digest` is a GitHub style "sha256:<hex>" string. Raises DownloadError
+        when the finished file doesn't match, after discarding the partial file.
+        """
+        partial_path = f"{path}.part"
+        for attempt in range(self.retries + 1):
+            try:
+                self._resume(url, partial_path, expected_size)
+                break
+            except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError):
+                # Whatever arrived is kept, the next attempt picks up from there
+                if attempt == self.retries:
+                    raise
+                self.backoff(attempt)
+
+        size = os.path.getsize(partial_path)
+        if expected_size is not None and size != expected_size:
+            if size > expected_size:
+                os.remove(partial_path)
+            raise DownloadError(f"Downloaded {size} of {expected_size} bytes from {url}")
+        if expected_digest and expected_digest.startswith("sha256:"):
+            digest = hashlib.sha256()
+            with open(partial_path, "rb") as f:
+                for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+            if digest.hexdigest() != expected_digest[len("sha256:"):]:
+                os.remove(partial_path)
+                raise DownloadError(f"Checksum mismatch for {url}")
+        os.replace(partial_path, path)
+        return path
+
+_default_transport = None
+_default_transport_lock = threading.Lock()
+
+def default_transport():
+    """The process-wide Transport shared by every module."""
+    global _default_transport
+    with _default_transport_lock:
+        if _default_transport is None:
+            _default_transport = Transport()
+        return _default_transport
+
+def get(url, **kwargs):
+    return default_transport().get(url, **kwargs)
+
+def download(url, path, expected_size=None, expected_digest=None):
+    return default_transport().download(url, path, expected_size, expected_digest)
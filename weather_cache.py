@@ -0,0 +1,116 @@
+"""
+Persistent cache for Open-Meteo responses.
+
+Geocoding results never change, so they are kept until evicted. Weather
+responses expire after a TTL matched to Open-Meteo's update cadence: current
+conditions are refreshed every 15 minutes, so by default a forecast fetched less
+than 15 minutes ago is reused. The cache holds at most `max_entries` rows and
+evicts the least recently used ones first. Hits and misses per kind of entry
+are counted in telemetry, and show up in `stats`.
+"""
+
+import configparser
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import telemetry
+
+CACHE_FILE = "weather_cache.db"
+DEFAULT_TTL = 15 * 60
+DEFAULT_MAX_ENTRIES = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    stored_at REAL NOT NULL,
+    used_at REAL NOT NULL,
+    PRIMARY KEY (kind, key)
+);
+CREATE INDEX IF NOT EXISTS entries_used_at ON entries (used_at);
+"""
+
+def normalise_city(city):
+    """'  new   YORK ' and 'New York' share one geocoding entry."""
+    return " ".join(city.split()).casefold()
+
+def forecast_key(latitude, longitude, params):
+    """Key a weather request by rounded coordinates and the remaining query parameters."""
+    params = {k: v for k, v in params.items() if k not in ("latitude", "longitude")}
+    return json.dumps([round(latitude, 3), round(longitude, 3), params], sort_keys=True)
+
+class WeatherCache:
+    def __init__(self, db_path, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+
+    def get(self, kind, key, ttl=None):
+        """Return the cached value, or None when missing or older than `ttl` seconds."""
+        now = time.time()
+        with self.lock, self.conn:
+            row = self.conn.execute(
+                "SELECT value, stored_at FROM entries WHERE kind = ? AND key = ?", (kind, key)
+            ).fetchone()
+            if row is None or (ttl is not None and now - row[1] > ttl):
+                telemetry.count("cache", cache=f"weather_{kind}", outcome="miss")
+                return None
+            self.conn.execute("UPDATE entries SET used_at = ? WHERE kind = ? AND key = ?", (now, kind, key))
+        telemetry.count("cache", cache=f"weather_{kind}", outcome="hit")
+        return json.loads(row[0])
+
+    def put(self, kind, key, value):
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entries (kind, key, value, stored_at, used_at) VALUES (?, ?, ?, ?, ?)",
+                (kind, key, json.dumps(value), now, now)
+            )
+            self.conn.execute(
+                """DELETE FROM entries WHERE rowid IN (
+                     SELECT rowid FROM entries ORDER BY used_at DESC LIMIT -1 OFFSET ?)""",
+                (self.max_entries,)
+            )
+
+    def fetch(self, kind, key, loader, ttl=None):
+        """Return the cached value for `key`, calling `loader()` and storing its result on a miss."""
+        value = self.get(kind, key, ttl)
+        if value is None:
+            value = loader()
+            self.put(kind, key, value)
+        return value
+
+    def clear(self):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM entries")
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def default_cache():
+    """The shared cache stored next to this module.
+
+    The TTL and size can be set in config.ini:
+      [Weather]
+      cache_ttl = 900
+      cache_max_entries = 1000
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            directory = os.path.dirname(os.path.abspath(__file__))
+            config = configparser.ConfigParser()
+            config.read(os.path.join(directory, 'config.ini'))
+            _default_cache = WeatherCache(
+                os.path.join(directory, CACHE_FILE),
+                config.getint('Weather', 'cache_ttl', fallback=DEFAULT_TTL),
+                config.getint('Weather', 'cache_max_entries', fallback=DEFAULT_MAX_ENTRIES)
+            )
+        return _default_cache
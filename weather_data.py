@@ -10,32 +10,61 @@ How to run this script:
 3. With forecast:
    python weather_data.py --city "City Name" --forecast
 
+4. Bypassing the geocoding/weather cache:
+   python weather_data.py --city "City Name" --no-cache
+
 Replace "City Name" with the name of the city you want to fetch weather data for.
 """
 
 import requests
 import argparse
-from openai import OpenAI
 import json
 import configparser
 import os
 from datetime import datetime, timezone
+import weather_cache
+import telemetry
+import transport
+
+GEOCODING_URL = "https://geocoding-api.open-meteo.com/v1/search"
+FORECAST_URL = "https://api.open-meteo.com/v1/forecast"
+
+def get_json(http, url, params):
+    with telemetry.span("geocode" if url == GEOCODING_URL else "weather"):
+        response = http.get(url, params=params)
+    telemetry.count("api_calls", api="open-meteo")
+    response.raise_for_status()
+    return response.json()
 
-def fetch_weather(city, use_forecast=False):
-    """Fetch current weather data for a specified city using Open-Meteo API."""
-    base_url = "https://geocoding-api.open-meteo.com/v1/search"
+def geocode(city, http, cache):
     params = {"name": city, "count": 1, "language": "en", "format": "json"}
+    geocode_key = weather_cache.normalise_city(city)
+    location_data = cache.get("geocode", geocode_key) if cache else None
+    if location_data is None:
+        location_data = get_json(http, GEOCODING_URL, params)
+        # Only cache cities that were found, so a typo can still be corrected
+        if cache and location_data.get("results"):
+            cache.put("geocode", geocode_key, location_data)
+    return location_data
+
+def fetch_weather(city, use_forecast=False, session=None, cache=None):
+    """Fetch current weather data for a specified city using Open-Meteo API.
+
+    Requests go through the shared transport unless another `session` is given.
+    Geocoding and weather responses go through `cache` (the shared
+    weather_cache by default); pass cache=False to always hit the API.
+    """
+    http = session or transport.default_transport()
+    if cache is None:
+        cache = weather_cache.default_cache()
     
     try:
-        response = requests.get(base_url, params=params)
-        response.raise_for_status()
-        location_data = response.json()
+        location_data = geocode(city, http, cache)
         
-        if location_data["results"]:
+        if location_data.get("results"):
             lat = location_data["results"][0]["latitude"]
             lon = location_data["results"][0]["longitude"]
             
-            weather_url = f"https://api.open-meteo.com/v1/forecast"
             weather_params = {
                 "latitude": lat,
                 "longitude": lon,
@@ -46,9 +75,13 @@ def fetch_weather(city, use_forecast=False):
                 "forecast_days": 1
             }
             
-            weather_response = requests.get(weather_url, params=weather_params)
-            weather_response.raise_for_status()
-            weather_data = weather_response.json()
+            if cache:
+                weather_data = cache.fetch(
+                    "forecast", weather_cache.forecast_key(lat, lon, weather_params),
+                    lambda: get_json(http, FORECAST_URL, weather_params), cache.ttl
+                )
+            else:
+                weather_data = get_json(http, FORECAST_URL, weather_params)
 
             if use_forecast:
                 forecast_weather = {
@@ -73,6 +106,86 @@ def fetch_weather(city, use_forecast=False):
         print(f"Error fetching weather data: {e}")
         return None
 
+def fetch_hourly_forecast(city, hours=24, session=None, cache=None):
+    """Fetch the conditions for each of the next `hours` hours, starting with the current hour.
+
+    Every entry has the fields of fetch_weather's current conditions plus `time`,
+    the start of the hour as a Unix timestamp. Returns None when the city or the
+    forecast can't be fetched.
+    """
+    http = session or transport.default_transport()
+    if cache is None:
+        cache = weather_cache.default_cache()
+
+    try:
+        location_data = geocode(city, http, cache)
+        if not location_data.get("results"):
+            print(f"Error: Could not find location data for {city}")
+            return None
+        location = location_data["results"][0]
+        weather_params = {
+            "latitude": location["latitude"],
+            "longitude": location["longitude"],
+            "hourly": ["temperature_2m", "weathercode", "is_day"],
+            "temperature_unit": "celsius",
+            "timeformat": "unixtime",
+            "timezone": "auto",
+            "forecast_days": min(16, hours // 24 + 2)
+        }
+        if cache:
+            forecast = cache.fetch(
+                "hourly", weather_cache.forecast_key(location["latitude"], location["longitude"], weather_params),
+                lambda: get_json(http, FORECAST_URL, weather_params), cache.ttl
+            )
+        else:
+            forecast = get_json(http, FORECAST_URL, weather_params)
+    except requests.RequestException as e:
+        print(f"Error fetching weather data: {e}")
+        return None
+
+    hourly = forecast["hourly"]
+    start = datetime.now(timezone.utc).timestamp() - 3600
+    upcoming = []
+    for hour_start, temperature, weathercode, is_day in zip(hourly["time"], hourly["temperature_2m"], hourly["weathercode"], hourly["is_day"]):
+        if hour_start <= start or len(upcoming) == hours:
+            continue
+        upcoming.append({
+            "time": hour_start,
+            "temperature": temperature,
+            "weathercode": weathercode,
+            "is_day": is_day,
+            "country": location["country"],
+            "weather_description": get_weather_description(weathercode),
+            "season": get_astronomical_season(datetime.fromtimestamp(hour_start, timezone.utc), location["latitude"])
+        })
+    return upcoming
+
+def find_transitions(hourly_weather):
+    """Return the hours whose weathercode, season or day/night differ from the hour before.
+
+    The first hour is always included, it is the condition in effect now.
+    """
+    transitions = []
+    previous = None
+    for hour in hourly_weather:
+        condition = (hour["weathercode"], hour["season"], hour["is_day"])
+        if condition != previous:
+            transitions.append(hour)
+            previous = condition
+    return transitions
+
+def weather_key(weather_data, temperature_step=5):
+    """Normalise weather data into a reuse key: weathercode, season, temperature bucket, day/night and country."""
+    temperature = weather_data.get('temperature', weather_data.get('temperature_max'))
+    bucket = int(temperature // temperature_step * temperature_step) if temperature is not None else None
+    return "|".join(str(part) for part in (
+        weather_data.get('weathercode'),
+        weather_data.get('season'),
+        bucket,
+        weather_data.get('is_day', ''),
+        weather_data.get('country')
+    ))
+
 def get_weather_description(weathercode):
     """Convert Open-Meteo weather code to a description."""
     weather_codes = {
@@ -104,15 +217,18 @@ def generate_gpt4_prompt(client, weather_data, weather_type=None):
     else:
         forecast_text = "current"
 
-    response = client.chat.completions.create(
-        model="gpt-4",
-        messages=[
-            {"role": "system", "content": "You are a creative assistant specialized in generating unique and captivating prompts for wallpaper creation based on weather conditions."},
-            {"role": "user", "content": f"The prompt should be suitable for creating a stunning desktop wallpaper that reflects the {forecast_text} weather conditions in an artistic and visually appealing manner."},
-            {"role": "user", "content": f"Generate a long one line prompt, ensure the image contains no text and try not include any known landmarks or places."},
-            {"role": "user", "content": f"{weather_data}."}
-        ]
-    )
+    with telemetry.span("gpt4_prompt"):
+        response = client.chat.completions.create(
+            model="gpt-4",
+            messages=[
+                {"role": "system", "content": "You are a creative assistant specialized in generating unique and captivating prompts for wallpaper creation based on weather conditions."},
+                {"role": "user", "content": f"The prompt should be suitable for creating a stunning desktop wallpaper that reflects the {forecast_text} weather conditions in an artistic and visually appealing manner."},
+                {"role": "user", "content": f"Generate a long one line prompt, ensure the image contains no text and try not include any known landmarks or places."},
+                {"role": "user", "content": f"{weather_data}."}
+            ]
+        )
+    telemetry.count("api_calls", api="chat")
+    telemetry.count("cost_usd", telemetry.token_cost("gpt-4", response.usage), api="chat")
     return response.choices[0].message.content
 
 def get_astronomical_season(date=None, latitude=None):
@@ -147,12 +263,13 @@ def main():
     parser.add_argument("--city", type=str, required=True, help="City name for weather data")
     parser.add_argument("--no-prompt", action="store_true", help="Skip AI prompt generation and output weather data only")
     parser.add_argument("--forecast", action="store_true", help="Use forecast weather data")
+    parser.add_argument("--no-cache", action="store_true", help="Skip the geocoding/weather cache")
     args = parser.parse_args()
 
     use_forecast = args.forecast
 
     print(f"Fetching {'forecast' if use_forecast else 'current'} weather data for {args.city}...")
-    weather_data = fetch_weather(args.city, use_forecast)
+    weather_data = fetch_weather(args.city, use_forecast, cache=False if args.no_cache else None)
     if weather_data:
         print("Weather data successfully fetched.")
         if args.no_prompt:
@@ -163,6 +280,7 @@ def main():
             config_path = os.path.join(os.path.dirname(__file__), 'config.ini')
             config.read(config_path)
             openai_api_key = config['OpenAI']['api_key']
+            from openai import OpenAI
             client = OpenAI(api_key=openai_api_key)
 
             # Read the weather option from config.ini